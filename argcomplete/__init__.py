@@ -4,10 +4,18 @@
 from __future__ import annotations
 
 from . import completers
-from .completers import ChoicesCompleter, DirectoriesCompleter, EnvironCompleter, FilesCompleter, SuppressCompleter
+from .completers import (
+    CachedCompleter,
+    ChoicesCompleter,
+    DirectoriesCompleter,
+    EnvironCompleter,
+    FilesCompleter,
+    SuppressCompleter,
+)
 from .exceptions import ArgcompleteException
 from .finders import CompletionFinder, ExclusiveCompletionFinder, safe_actions
 from .io import debug, mute_stderr, warn
+from .lazy import LazySubParsersAction
 from .lexers import split_line
 from .shell_integration import shellcode
 
@@ -0,0 +1,90 @@
+"""
+Client for argcomplete completion servers (see argcomplete.daemon).
+
+A copy of this file is installed next to the server sockets and invoked by argcomplete's shell code with the command
+that would otherwise be run to get completions. It forwards the completion request to the server for that command and
+writes the completions to fd 8 (or to $_ARGCOMPLETE_STDOUT_FILENAME) unless the server wrote them already. It exits
+with a non-zero status if there is no server able to handle the request, in which case the shell code runs the command
+as usual.
+
+This file only uses the standard library, so that it can be run with ``python -I -S``.
+"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+
+TIMEOUT = 5
+
+
+def target(args):
+    # Scripts run by an interpreter (as global completion does) are served under the name of the script.
+    if len(args) > 1 and os.path.basename(args[0]).startswith("python"):
+        return args[-1]
+    return args[0]
+
+
+def is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+
+def send_request(path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(TIMEOUT)
+        sock.connect(path)
+        # Pass the output and debug file descriptors, which fork servers hand to the process that completes the request
+        # under the numbers listed in the request
+        fds = [fd for fd in (8, 9) if is_open(fd)]
+        data = json.dumps(dict(request, fds=fds)).encode() + b"\n"
+        sent = socket.send_fds(sock, [data], fds)
+        if sent < len(data):
+            sock.sendall(data[sent:])
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+def main(args):
+    if not args:
+        return 2
+    executable = target(args)
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.basename(executable) + ".sock")
+    if not os.path.exists(path):
+        return 1
+    request = {
+        "executable": os.path.realpath(shutil.which(executable) or executable),
+        "cwd": os.getcwd(),
+        "environ": dict(os.environ),
+    }
+    try:
+        reply = send_request(path, request)
+    except (OSError, ValueError):
+        return 1
+    if reply.get("status") != "ok":
+        return 1
+    if "output" not in reply:
+        # The server wrote the completions itself
+        return 0
+    output = reply["output"].encode(errors="surrogateescape")
+    filename = os.environ.get("_ARGCOMPLETE_STDOUT_FILENAME")
+    if filename is not None:
+        with open(filename, "wb") as fh:
+            fh.write(output)
+    else:
+        with open(8, "wb", closefd=False) as fh:
+            fh.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,45 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+from __future__ import annotations
+
+import sys
+from bisect import bisect_left
+from collections.abc import Sequence
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class PrefixIndex(Generic[T]):
+    """
+    Values indexed by string keys, sorted so that the values of the keys starting with a prefix can be found by
+    bisection instead of by testing every key.
+    """
+
+    def __init__(self, keys: Sequence[str], values: Sequence[T]) -> None:
+        # Sorting positions by key is much faster than sorting (key, value) pairs
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.values = [values[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find(self, prefix: str) -> list[T]:
+        """
+        Returns the values of the keys starting with **prefix**, in the order of their keys.
+        """
+        keys = self.keys
+        start = bisect_left(keys, prefix)
+        if not prefix:
+            end = len(keys)
+        elif ord(prefix[-1]) < sys.maxunicode:
+            # The keys starting with the prefix sort before the first string that is greater than the prefix in its
+            # last character
+            end = bisect_left(keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        else:
+            end = start
+            while end < len(keys) and keys[end].startswith(prefix):
+                end += 1
+        return self.values[start:end]
@@ -0,0 +1,223 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+# This file contains the on-disk caches used to avoid repeating expensive work across completion processes.
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from typing import Any
+
+from .io import debug
+from .spec import SPEC_VERSION
+
+REFRESH_TIMEOUT = 300
+
+
+def cache_dir(*subdirs: str) -> str:
+    """
+    Returns the argcomplete cache directory (``$XDG_CACHE_HOME/argcomplete``, or ``~/.cache/argcomplete``).
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "argcomplete", *subdirs)
+
+
+def atomic_write(path: str, data: str) -> None:
+    """
+    Writes **data** to **path** so that concurrent readers see either the old or the new contents, never a mix.
+    """
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _installed_distributions_digest() -> str:
+    # Distribution metadata directories encode the distribution name and version (e.g. "argcomplete-3.7.2.dist-info"),
+    # so listing them is a cheap way to notice upgrades without importing importlib.metadata.
+    digest = hashlib.sha256()
+    for entry in sys.path:
+        try:
+            names = sorted(n for n in os.listdir(entry or ".") if n.endswith((".dist-info", ".egg-info", ".egg-link")))
+        except OSError:
+            continue
+        digest.update(entry.encode(errors="surrogateescape"))
+        for name in names:
+            digest.update(name.encode(errors="surrogateescape"))
+    return digest.hexdigest()
+
+
+def executable_fingerprint(executable: str | None = None) -> dict[str, Any]:
+    """
+    Returns a fingerprint of the running program that changes when its script, installed distributions or Python
+    interpreter change.
+    """
+    if executable is None:
+        executable = os.path.abspath(sys.argv[0])
+    try:
+        mtime = os.stat(executable).st_mtime_ns
+    except OSError:
+        mtime = None
+    return {
+        "executable": executable,
+        "mtime": mtime,
+        "python": sys.version,
+        "distributions": _installed_distributions_digest(),
+        "spec_version": SPEC_VERSION,
+    }
+
+
+def _spec_cache_path(fingerprint: dict[str, Any]) -> str:
+    key = hashlib.sha256(fingerprint["executable"].encode(errors="surrogateescape")).hexdigest()
+    return cache_dir("specs", key + ".json")
+
+
+def load_spec(fingerprint: dict[str, Any]) -> dict[str, Any] | None:
+    """
+    Returns the cached completion spec for the program identified by **fingerprint**, or ``None`` if there is no spec
+    cached for it or the cached spec was produced for a different fingerprint.
+    """
+    path = _spec_cache_path(fingerprint)
+    try:
+        with open(path) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        debug("No cached spec found at", path)
+        return None
+    if entry.get("fingerprint") != fingerprint:
+        debug("Cached spec at", path, "is stale")
+        return None
+    debug("Using cached spec at", path)
+    return entry["spec"]
+
+
+def save_spec(fingerprint: dict[str, Any], spec: dict[str, Any]) -> None:
+    path = _spec_cache_path(fingerprint)
+    try:
+        atomic_write(path, json.dumps({"fingerprint": fingerprint, "spec": spec}))
+    except OSError as e:
+        debug("Unable to write spec cache", path, e)
+    else:
+        debug("Saved spec to", path)
+
+
+def completions_dir(name: str) -> str:
+    """
+    Returns the directory holding the cached completions of the completer called **name** in the running program.
+    """
+    key = hashlib.sha256(f"{os.path.abspath(sys.argv[0])}\0{name}".encode(errors="surrogateescape")).hexdigest()
+    return cache_dir("completers", key)
+
+
+def completions_path(directory: str, key: Any) -> str:
+    """
+    Returns the path of the cache entry for **key** (any JSON-serializable value) in **directory**.
+    """
+    data = json.dumps(key, sort_keys=True, default=repr).encode(errors="surrogateescape")
+    return os.path.join(directory, hashlib.sha256(data).hexdigest() + ".json")
+
+
+def load_completions(path: str) -> tuple[float, list[str] | dict[str, str]] | None:
+    """
+    Returns the age in seconds and the completions cached at **path**, or ``None`` if there are none.
+    """
+    try:
+        with open(path) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or "completions" not in entry:
+        return None
+    try:
+        # The modification time orders entries for eviction, so that the least recently used ones go first
+        os.utime(path)
+    except OSError:
+        pass
+    return time.time() - entry.get("time", 0), entry["completions"]
+
+
+def save_completions(path: str, completions: list[str] | dict[str, str], max_entries: int) -> None:
+    """
+    Caches **completions** at **path**, evicting the least recently used entries in its directory beyond
+    **max_entries**.
+    """
+    try:
+        atomic_write(path, json.dumps({"time": time.time(), "completions": completions}))
+    except OSError as e:
+        debug("Unable to write completion cache", path, e)
+        return
+    entries = []
+    with contextlib.suppress(OSError), os.scandir(os.path.dirname(path)) as it:
+        for entry in it:
+            if entry.name.endswith(".json"):
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+    for _, evicted_path in sorted(entries)[: max(len(entries) - max_entries, 0)]:
+        debug("Evicting cached completions at", evicted_path)
+        with contextlib.suppress(OSError):
+            os.unlink(evicted_path)
+
+
+def claim_refresh(path: str) -> bool:
+    """
+    Returns whether the calling process may refresh the completions cached at **path**, which is the case unless another
+    process started refreshing them less than ``REFRESH_TIMEOUT`` seconds ago. The claim is released with
+    :func:`release_refresh`.
+    """
+    marker = path + ".refresh"
+    for _ in range(2):
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(marker).st_mtime < REFRESH_TIMEOUT:
+                    return False
+                # The refreshing process must have died
+                os.unlink(marker)
+            except OSError:
+                return False
+        except OSError:
+            return False
+    return False
+
+
+def release_refresh(path: str) -> None:
+    with contextlib.suppress(OSError):
+        os.unlink(path + ".refresh")
+
+
+@contextlib.contextmanager
+def locked(directory: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on **directory** (shared by all processes of the user) while the context is active. If the
+    lock can't be taken, the context runs without it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # There is no flock() on Windows; concurrent completions may then compute the same entries
+        yield
+        return
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fh = open(os.path.join(directory, ".lock"), "a")
+    except OSError as e:
+        debug("Unable to lock", directory, e)
+        yield
+        return
+    with fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        yield
@@ -5,10 +5,16 @@ from __future__ import annotations
 
 import argparse
 import os
+import re
 import subprocess
-from collections.abc import Callable, Generator, Iterable, Mapping
+from collections.abc import Callable, Generator, Iterable, Mapping, Sequence
+from collections.abc import Set as AbstractSet
+from fnmatch import fnmatchcase
 from shlex import quote
-from typing import Final
+from typing import Any, Final
+
+from ._index import PrefixIndex
+from .io import debug
 
 _Ignored = object
 
@@ -34,10 +40,25 @@ class BaseCompleter:
 
 
 class ChoicesCompleter(BaseCompleter):
+    """
+    Completes the choices in **choices**. If **ignore_case** is true, choices match the word being completed regardless
+    of case.
+
+    With the default validator, the finder looks up the choices matching the word being completed with
+    :meth:`complete_prefix` instead of testing every choice. Sequences and sets of choices are sorted into an index the
+    first time, which is rebuilt if the choices change. Other iterables of choices, such as mappings (like
+    ``os.environ``) and generators, are searched on each call instead.
+    """
+
     choices: Final[Mapping[str, str | bytes]]
+    ignore_case: Final[bool]
 
-    def __init__(self, choices: Mapping[str, str | bytes]) -> None:
+    def __init__(self, choices: Mapping[str, str | bytes], ignore_case: bool = False) -> None:
         self.choices = choices
+        self.ignore_case = ignore_case
+        self._index: PrefixIndex[int] | None = None
+        self._snapshot: tuple | None = None
+        self._converted: list[str] = []
 
     def _convert(self, choice):
         if not isinstance(choice, str):
@@ -47,6 +68,26 @@ class ChoicesCompleter(BaseCompleter):
     def __call__(self, **kwargs: _Ignored) -> Iterable[str]:
         return (self._convert(c) for c in self.choices)
 
+    def complete_prefix(self, prefix: str) -> list[str]:
+        """
+        Returns the choices starting with **prefix** (ignoring case if ``ignore_case`` is true), in their original
+        order.
+        """
+        if not isinstance(self.choices, (Sequence, AbstractSet)):
+            if self.ignore_case:
+                prefix = prefix.casefold()
+                return [c for c in self() if c.casefold().startswith(prefix)]
+            return [c for c in self() if c.startswith(prefix)]
+        index = self._index
+        snapshot = tuple(self.choices)
+        if index is None or snapshot != self._snapshot:
+            self._snapshot = snapshot
+            self._converted = [self._convert(c) for c in snapshot]
+            keys = [c.casefold() for c in self._converted] if self.ignore_case else self._converted
+            index = self._index = PrefixIndex(keys, range(len(keys)))
+        positions = index.find(prefix.casefold() if self.ignore_case else prefix)
+        return [self._converted[i] for i in sorted(positions)]
+
 
 EnvironCompleter: Final[ChoicesCompleter] = ChoicesCompleter(os.environ)
 
@@ -54,20 +95,43 @@ EnvironCompleter: Final[ChoicesCompleter] = ChoicesCompleter(os.environ)
 class FilesCompleter(BaseCompleter):
     """
     File completer class, optionally takes a list of allowed extensions
+
+    Completions are read from the file system in-process, following the semantics of bash's ``compgen -A file``: a
+    leading ``~/`` or ``~user/`` is expanded for the lookup but kept in the completions, hidden files are included, and
+    directories (including symlinks to directories) get a trailing slash. Pass ``compgen=True`` to run ``compgen`` in a
+    bash subprocess instead, as earlier versions of argcomplete did.
     """
 
     allowednames: Final[list[str]]
     directories: Final[bool]
+    compgen: Final[bool]
 
-    def __init__(self, allowednames: Iterable[str] | str = (), directories: bool = True) -> None:
+    def __init__(self, allowednames: Iterable[str] | str = (), directories: bool = True, compgen: bool = False) -> None:
         # Fix if someone passes in a string instead of a list
         if isinstance(allowednames, (str, bytes)):
             allowednames = [allowednames]
 
         self.allowednames = [x.lstrip("*").lstrip(".") for x in allowednames]
         self.directories = directories
+        self.compgen = compgen
 
     def __call__(self, prefix: str, **kwargs: _Ignored) -> list[str]:
+        if self.compgen:
+            return self._compgen_completions(prefix)
+        entries = _list_directory(prefix)
+        completion: list[str] = []
+        if self.allowednames:
+            if self.directories:
+                completion += [f + "/" for f, is_dir in entries if is_dir]
+            for x in self.allowednames:
+                completion += [f for f, _ in entries if fnmatchcase(f, f"*.{x}")]
+        else:
+            completion += [f for f, is_dir in entries if not is_dir]
+            if self.directories:
+                completion += [f + "/" for f, is_dir in entries if is_dir]
+        return completion
+
+    def _compgen_completions(self, prefix: str) -> list[str]:
         completion: list[str] = []
         if self.allowednames:
             if self.directories:
@@ -98,6 +162,43 @@ class FilesCompleter(BaseCompleter):
         return completion
 
 
+# $NAME and ${NAME} references, which bash expands (to nothing if the variable is not set) before listing files
+_variable_reference = re.compile(r"\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([A-Za-z_][A-Za-z0-9_]*)\})")
+
+
+def _expand_variables(path: str) -> str:
+    if "$" not in path:
+        return path
+    return _variable_reference.sub(lambda m: os.environ.get(m.group(1) or m.group(2), ""), path)
+
+
+def _list_directory(prefix: str) -> list[tuple[str, bool]]:
+    """
+    Returns the paths starting with **prefix** and whether each is a directory, like ``compgen -A file``. A leading
+    ``~`` and variable references in the directory part are expanded for the lookup, but kept in the returned paths.
+    """
+    head, sep, name = prefix.rpartition("/")
+    head += sep
+    if prefix.startswith("~") and not sep:
+        # Completing user names is not supported
+        return []
+    entries = []
+    if name.startswith("."):
+        entries += [(head + special, True) for special in (".", "..") if special.startswith(name)]
+    try:
+        with os.scandir(_expand_variables(os.path.expanduser(head)) if head else ".") as it:
+            for entry in it:
+                if entry.name.startswith(name):
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entries.append((head + entry.name, is_dir))
+    except OSError:
+        return []
+    return sorted(entries)
+
+
 class _FilteredFilesCompleter(BaseCompleter):
     predicate: Final[Callable[[str], bool]]
 
@@ -120,18 +221,20 @@ class _FilteredFilesCompleter(BaseCompleter):
         expanded_prefix = os.path.expanduser(prefix)
         target_dir = os.path.dirname(expanded_prefix)
         try:
-            names = os.listdir(target_dir or ".")
+            # Entries are read as they are needed, so that callers can stop early in huge directories
+            entries = os.scandir(target_dir or ".")
         except Exception:
             return  # empty iterator
         incomplete_part = os.path.basename(expanded_prefix)
         # Iterate on target_dir entries and filter on given predicate
-        for name in names:
-            if not name.startswith(incomplete_part):
-                continue
-            candidate = os.path.join(target_dir, name)
-            if not self.predicate(candidate):
-                continue
-            yield candidate + "/" if os.path.isdir(candidate) else candidate
+        with entries:
+            for entry in entries:
+                if not entry.name.startswith(incomplete_part):
+                    continue
+                candidate = os.path.join(target_dir, entry.name)
+                if not self.predicate(candidate):
+                    continue
+                yield candidate + "/" if os.path.isdir(candidate) else candidate
 
 
 class DirectoriesCompleter(_FilteredFilesCompleter):
@@ -152,3 +255,85 @@ class SuppressCompleter(BaseCompleter):
         Decide if the completion should be suppressed
         """
         return True
+
+
+class CachedCompleter(BaseCompleter):
+    """
+    Wraps the completer **inner**, caching its completions on disk (under ``$XDG_CACHE_HOME/argcomplete/completers``) so
+    that the completion processes started for later TABs reuse them for **ttl** seconds. Completions are cached for each
+    prefix, action and combination of values of the ``parsed_args`` attributes named in **key**. At most
+    **max_entries** sets of completions are kept, evicting the least recently used ones. Completions that are not cached
+    yet are computed by one process at a time, so that concurrent completions don't all run **inner**.
+
+    If **refresh** is true, expired completions are still used, while a detached process (at most one for each set of
+    completions) runs **inner** again to update them for the next completion. This keeps completions fast for data that
+    changes slowly, at the cost of using completions that are out of date once.
+
+    Completions are cached under **name** (by default, the qualified name of **inner**), which must be unique among the
+    completers of the program.
+    """
+
+    def __init__(
+        self,
+        inner: Callable[..., Iterable[str] | Mapping[str, str]],
+        ttl: float = 60,
+        key: Iterable[str] = (),
+        max_entries: int = 256,
+        name: str | None = None,
+        refresh: bool = False,
+    ) -> None:
+        self.inner = inner
+        self.ttl = ttl
+        self.key = list(key)
+        self.max_entries = max_entries
+        if name is None:
+            name = f"{getattr(inner, '__module__', None)}.{getattr(inner, '__qualname__', type(inner).__qualname__)}"
+        self.name = name
+        self.refresh = refresh
+
+    def __call__(
+        self, *, prefix: str, action: argparse.Action, parser: argparse.ArgumentParser, parsed_args: argparse.Namespace
+    ) -> list[str] | dict[str, str]:
+        from . import cache
+
+        key = [prefix, action.dest, {name: getattr(parsed_args, name, None) for name in self.key}]
+        directory = cache.completions_dir(self.name)
+        path = cache.completions_path(directory, key)
+        kwargs = {"prefix": prefix, "action": action, "parser": parser, "parsed_args": parsed_args}
+        entry = cache.load_completions(path)
+        if entry is not None:
+            age, completions = entry
+            if age <= self.ttl:
+                debug("Using cached completions at", path)
+                return completions
+            if self.refresh:
+                if cache.claim_refresh(path):
+                    from .daemon import spawn
+
+                    debug("Using expired completions at", path, "while refreshing them in the background")
+                    spawn(lambda: self._refresh(path, kwargs))
+                else:
+                    debug("Using expired completions at", path, "while another process refreshes them")
+                return completions
+        with cache.locked(directory):
+            # Another process may have computed the completions while this one waited for the lock
+            entry = cache.load_completions(path)
+            if entry is not None and entry[0] <= self.ttl:
+                return entry[1]
+            completions = self._complete(**kwargs)
+            cache.save_completions(path, completions, self.max_entries)
+        return completions
+
+    def _refresh(self, path: str, kwargs: dict[str, Any]) -> None:
+        from . import cache
+
+        try:
+            cache.save_completions(path, self._complete(**kwargs), self.max_entries)
+        finally:
+            cache.release_refresh(path)
+
+    def _complete(self, **kwargs: Any) -> list[str] | dict[str, str]:
+        output = self.inner(**kwargs)
+        if isinstance(output, Mapping):
+            return {str(completion): str(description) for completion, description in output.items()}
+        return [str(completion) for completion in output]
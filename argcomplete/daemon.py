@@ -0,0 +1,332 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+# This file contains the completion server, which keeps a program's argument parser loaded between completions.
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import socket
+import sys
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from . import cache
+from .io import debug
+
+CLIENT_NAME = "client"
+
+
+def runtime_dir() -> str:
+    """
+    Returns the per-user directory holding completion server sockets (``$XDG_RUNTIME_DIR/argcomplete``, or
+    ``/tmp/argcomplete-<uid>``). The same directory is used by the shell code in :mod:`argcomplete.shell_integration`.
+    """
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "argcomplete")
+    return f"/tmp/argcomplete-{os.getuid()}"
+
+
+def socket_path(executable: str | None = None) -> str:
+    """
+    Returns the path of the completion server socket for **executable** (by default, the running program).
+    """
+    if executable is None:
+        executable = sys.argv[0]
+    return os.path.join(runtime_dir(), os.path.basename(executable) + ".sock")
+
+
+def _ensure_private_dir(path: str) -> bool:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        debug("Refusing to use runtime directory", path, "which is not private to this user")
+        return False
+    return True
+
+
+def install_client(directory: str) -> str:
+    """
+    Installs the completion client in **directory**, using the running Python interpreter, and returns its path.
+    """
+    path = os.path.join(directory, CLIENT_NAME)
+    with open(os.path.join(os.path.dirname(__file__), "_daemon_client.py")) as fh:
+        code = f"#!{sys.executable} -IS\n" + fh.read()
+    try:
+        with open(path) as fh:
+            if fh.read() == code:
+                return path
+    except OSError:
+        pass
+    cache.atomic_write(path, code)
+    os.chmod(path, 0o700)
+    return path
+
+
+def _source_mtimes(paths: Iterable[str | None]) -> dict[str, int | None]:
+    mtimes: dict[str, int | None] = {}
+    for path in paths:
+        if path:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+    return mtimes
+
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # ru_maxrss is the peak resident set size, in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class _Exit(Exception):
+    def __init__(self, code: int = 0) -> None:
+        self.code = code
+
+
+def _raise_exit(code: int = 0) -> None:
+    raise _Exit(code)
+
+
+class CompletionServer:
+    """
+    Serves completions for **argument_parser** over a Unix socket, so that the shell doesn't have to start the program
+    again for each completion. Requests carry the environment and working directory of the completion client, and are
+    completed by **finder** (by default, a new :class:`argcomplete.CompletionFinder`) called with **finder_kwargs**.
+
+    The server exits when it has been idle for **idle_timeout** seconds, when the program or any of its loaded modules
+    change on disk, or when its resident set size exceeds **max_rss** bytes. It also exits after a completion that
+    abandoned completers at its deadline, as they may still be running in its threads, and would see the environment
+    and working directory of later requests. The next completion then runs the program as usual, which starts a new
+    server.
+    """
+
+    def __init__(
+        self,
+        argument_parser: argparse.ArgumentParser | Callable[[], argparse.ArgumentParser],
+        finder: Any = None,
+        path: str | None = None,
+        idle_timeout: float = 600,
+        max_rss: int = 256 * 1024 * 1024,
+        finder_kwargs: dict[str, Any] | None = None,
+    ) -> None:
+        if finder is None:
+            from .finders import CompletionFinder
+
+            finder = CompletionFinder()
+        self.argument_parser = argument_parser
+        self.finder = finder
+        self.path = socket_path() if path is None else path
+        self.executable = os.path.realpath(sys.argv[0])
+        self.idle_timeout = idle_timeout
+        self.max_rss = max_rss
+        self.finder_kwargs = finder_kwargs or {}
+        self.mtimes = _source_mtimes([sys.argv[0], *(getattr(m, "__file__", None) for m in list(sys.modules.values()))])
+        self.sock: socket.socket | None = None
+
+    def bind(self) -> bool:
+        """
+        Binds the server socket, unless the runtime directory is not private or another server is already listening.
+        """
+        directory = os.path.dirname(self.path)
+        if not _ensure_private_dir(directory):
+            return False
+        install_client(directory)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.bind(self.path)
+        except OSError:
+            try:
+                self.sock.connect(self.path)
+            except OSError:
+                debug("Replacing stale socket", self.path)
+                self.sock.close()
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                os.unlink(self.path)
+                self.sock.bind(self.path)
+            else:
+                debug("A completion server is already listening on", self.path)
+                self.sock.close()
+                self.sock = None
+                return False
+        self.sock.listen()
+        self.sock.settimeout(self.idle_timeout)
+        return True
+
+    def serve_forever(self) -> None:
+        assert self.sock is not None
+        # Debug output goes to the server's stderr: fd 9 of the shell is not available to the server
+        self.finder._init_debug_stream = lambda: None
+        try:
+            while True:
+                try:
+                    conn, _ = self.sock.accept()
+                except TimeoutError:
+                    debug("Completion server idle, exiting")
+                    return
+                with conn:
+                    if not self.handle(conn):
+                        return
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def is_stale(self) -> bool:
+        """
+        Returns whether the program or any of the modules it had loaded when the server started changed on disk.
+        """
+        return _source_mtimes(self.mtimes) != self.mtimes
+
+    def handle(self, conn: socket.socket) -> bool:
+        """
+        Handles one completion request on **conn**, and returns whether the server should keep serving.
+        """
+        conn.settimeout(self.idle_timeout)
+        fds: list[int] = []
+        try:
+            request, fds = self._read_request(conn)
+            if request.get("executable") != self.executable:
+                reply, keep_serving = {"status": "unknown executable"}, True
+            elif self.is_stale():
+                reply, keep_serving = {"status": "stale"}, False
+            else:
+                reply = self.complete(request, fds)
+                keep_serving = _rss() <= self.max_rss and not self.finder.expired_completers
+            conn.sendall(json.dumps(reply).encode())
+        except (OSError, ValueError) as e:
+            debug("Unable to handle completion request:", e)
+            return True
+        finally:
+            for fd in fds:
+                os.close(fd)
+        return keep_serving
+
+    def _read_request(self, conn: socket.socket) -> tuple[dict[str, Any], list[int]]:
+        # The client passes its output and debug file descriptors along with the first part of the request
+        chunk, fds, _, _ = socket.recv_fds(conn, 65536, 2)
+        chunks = [chunk]
+        while chunk and not chunk.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            chunks.append(chunk)
+        try:
+            return json.loads(b"".join(chunks)), fds
+        except ValueError:
+            for fd in fds:
+                os.close(fd)
+            raise
+
+    def _apply_request(self, request: dict[str, Any]) -> None:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["environ"])
+
+    def complete(self, request: dict[str, Any], fds: list[int]) -> dict[str, Any]:
+        """
+        Runs the finder for **request** and returns the reply to send to the client.
+        """
+        environ, cwd = dict(os.environ), os.getcwd()
+        output = io.StringIO()
+        # Debug output goes to the server's stderr, rather than to a new stream for fd 9 on each request
+        self.finder._init_debug_stream = lambda: None
+        try:
+            self._apply_request(request)
+            self.finder(
+                self.argument_parser, exit_method=_raise_exit, output_stream=output, daemon=False, **self.finder_kwargs
+            )
+        except _Exit as e:
+            if e.code != 0:
+                return {"status": "error"}
+        except Exception as e:
+            debug("Completion failed:", e)
+            return {"status": "error"}
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+        return {"status": "ok", "output": output.getvalue()}
+
+
+class ForkServer(CompletionServer):
+    """
+    A completion server that forks a new process for each request, instead of completing in the server process. Like
+    running the program for each completion, this keeps completers and argcomplete's patching of the argument parser
+    from affecting later completions, while copy-on-write memory makes the child start almost instantly. The child
+    writes completions directly to the output file descriptor passed by the client.
+    """
+
+    def complete(self, request: dict[str, Any], fds: list[int]) -> dict[str, Any]:
+        # The request lists the client's numbers for the file descriptors it passed, which may not include fd 8
+        targets = dict(zip(request.get("fds", ()), fds))
+        if len(targets) != len(fds) or 8 not in targets:
+            return {"status": "error"}
+        pid = os.fork()
+        if pid == 0:
+            try:
+                assert self.sock is not None
+                self.sock.close()
+                for target_fd, fd in targets.items():
+                    os.dup2(fd, target_fd)
+                self._apply_request(request)
+                self.finder(self.argument_parser, daemon=False, **self.finder_kwargs)
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        return {"status": "ok" if os.waitstatus_to_exitcode(status) == 0 else "error"}
+
+
+def _detach() -> None:
+    # Release the shell's command substitution pipe and terminal, keeping fds 8 and 9 valid for the finder
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2, 8, 9):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+    os.setsid()
+
+
+def spawn(target: Callable[[], Any]) -> None:
+    """
+    Runs **target** in a detached child process. The current process continues normally.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        if os.fork() == 0:
+            _detach()
+            target()
+    finally:
+        os._exit(0)
+
+
+def spawn_server(server: CompletionServer) -> None:
+    """
+    Starts **server** in a detached child process. The current process continues normally.
+    """
+    if " " in sys.executable:
+        # The client is run through a shebang line, which can't refer to such an interpreter
+        return
+
+    def serve() -> None:
+        if server.bind():
+            server.serve_forever()
+
+    spawn(serve)
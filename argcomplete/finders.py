@@ -6,16 +6,29 @@
 from __future__ import annotations
 
 import argparse
+import contextvars
+import functools
 import os
 import sys
-from collections.abc import Callable, Container, Mapping
-from typing import Literal, TextIO
+import threading
+import time
+import weakref
+from collections.abc import AsyncGenerator, Awaitable, Callable, Container, Iterable, Iterator, Mapping
+from typing import Any, Literal, TextIO, cast
 
 from . import io as _io
+from ._index import PrefixIndex
 from .completers import BaseCompleter, ChoicesCompleter, FilesCompleter, SuppressCompleter
 from .io import debug, mute_stderr
 from .lexers import split_line
-from .packages._argparse import IntrospectiveArgumentParser, action_is_greedy, action_is_open, action_is_satisfied
+from .packages._argparse import (
+    IntrospectiveArgumentParser,
+    action_is_greedy,
+    action_is_open,
+    action_is_satisfied,
+    completion_parse,
+)
+from .shells import get_dialect
 
 safe_actions = {
     argparse._StoreAction,
@@ -32,6 +45,266 @@ def default_validator(completion: str, prefix: str) -> bool:
     return completion.startswith(prefix)
 
 
+class _LiveParserRequired(Exception):
+    "Raised when completing from a cached spec reaches an action whose completer needs the live parser."
+
+
+class _DeferredCompleter(BaseCompleter):
+    def __call__(self, **kwargs):
+        raise _LiveParserRequired()
+
+
+# The finder whose parse is in progress. Patched parsers and actions are shared by all finders, and get the finder to
+# report to from here.
+_completing_finder: contextvars.ContextVar[CompletionFinder] = contextvars.ContextVar("_completing_finder")
+
+
+class _IntrospectAction(argparse.Action):
+    """
+    Base of the classes that the actions of patched parsers are switched to, which report to the finder whose parse is
+    in progress instead of running the original action, unless the action is known to be safe.
+    """
+
+    _orig_class: type[argparse.Action]
+    _orig_callable: Callable[..., None]
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        debug("Action stub called on", self)
+        debug("\targs:", parser, namespace, values, option_string)
+        debug("\torig class:", self._orig_class)
+        debug("\torig callable:", self._orig_callable)
+
+        finder = _completing_finder.get(None)
+        if finder is None or not finder.completing:
+            self._orig_callable(parser, namespace, values, option_string=option_string)
+        elif issubclass(self._orig_class, argparse._SubParsersAction):
+            debug("orig class is a subparsers action: patching and running it")
+            finder._patch_parser(self._name_parser_map[values[0]])  # type: ignore[attr-defined]
+            self._orig_callable(parser, namespace, values, option_string=option_string)
+        elif self._orig_class in safe_actions:
+            if not self.option_strings:
+                finder.visited_positionals.append(self)
+
+            self._orig_callable(parser, namespace, values, option_string=option_string)
+
+
+@functools.cache
+def _introspect_action_class(action_class: type[argparse.Action]) -> type[_IntrospectAction]:
+    return type("IntrospectAction", (_IntrospectAction, action_class), {})
+
+
+@functools.cache
+def _introspective_parser_class(parser_class: type[argparse.ArgumentParser]) -> type[IntrospectiveArgumentParser]:
+    return type("MonkeyPatchedIntrospectiveArgumentParser", (IntrospectiveArgumentParser, parser_class), {})
+
+
+def _readline_completions(completer, prefix):
+    for i in range(9999):
+        next_completion = completer.complete(prefix, i)
+        if next_completion is None:
+            break
+        yield next_completion
+
+
+def _is_async(output: Any) -> bool:
+    # Checked without inspect, which is slow to import and only needed by programs with asynchronous completers
+    return isinstance(output, (Awaitable, AsyncGenerator))
+
+
+# Completers of actions with choices, kept for as long as their action so that their prefix index is only built once
+_choices_completers: weakref.WeakKeyDictionary[argparse.Action, ChoicesCompleter] = weakref.WeakKeyDictionary()
+
+
+def _choices_completer(action: argparse.Action) -> ChoicesCompleter:
+    completer = _choices_completers.get(action)
+    if completer is None or completer.choices is not action.choices:
+        completer = _choices_completers[action] = ChoicesCompleter(action.choices)  # type: ignore[arg-type]
+    return completer
+
+
+class _SubcommandIndex:
+    """
+    The subcommand names and aliases of a subparsers action, with the pseudo-actions holding their help, sorted for
+    prefix lookups.
+    """
+
+    def __init__(self, action: argparse._SubParsersAction) -> None:
+        # Look up subparsers without dict subclass hooks, so that lazy subparsers are not built to list their names
+        choices = dict(dict.items(action.choices))
+        subaction_by_parser = {choices[subaction.dest]: subaction for subaction in action._get_subactions()}
+        self.size = len(choices)
+        self.names = list(choices)
+        self.subactions = [subaction_by_parser.get(subparser) for subparser in choices.values()]
+        self.index = PrefixIndex(self.names, range(len(self.names)))
+
+    def find(self, prefix: str) -> list[int]:
+        """
+        Returns the positions of the names starting with **prefix**, in the order the subcommands were added.
+        """
+        return sorted(self.index.find(prefix))
+
+
+# Kept for as long as their subparsers action, and rebuilt when subcommands are added
+_subcommand_indexes: weakref.WeakKeyDictionary[argparse.Action, _SubcommandIndex] = weakref.WeakKeyDictionary()
+
+
+class _OptionIndex:
+    """
+    The option strings of a parser with their actions, sorted for prefix lookups, and the long and short option strings
+    of each action.
+    """
+
+    def __init__(self, parser: argparse.ArgumentParser) -> None:
+        self.size = len(parser._actions)
+        self.last_action = parser._actions[-1] if parser._actions else None
+        self.option_strings: list[str] = []
+        self.actions: list[argparse.Action] = []
+        self.long_and_short: list[tuple[argparse.Action, list[str], list[str]]] = []
+        for action in parser._actions:
+            if not action.option_strings:
+                continue
+            self.option_strings += action.option_strings
+            self.actions += [action] * len(action.option_strings)
+            long_opts = [opt for opt in action.option_strings if len(opt) > 2]
+            short_opts = [opt for opt in action.option_strings if len(opt) <= 2]
+            self.long_and_short.append((action, long_opts, short_opts))
+        self.index = PrefixIndex(self.option_strings, range(len(self.option_strings)))
+
+    def is_current(self, parser: argparse.ArgumentParser) -> bool:
+        # Actions are only ever appended, so any change replaces the last action
+        actions = parser._actions
+        return self.size == len(actions) and self.last_action is (actions[-1] if actions else None)
+
+    def find(self, prefix: str) -> list[int]:
+        """
+        Returns the positions of the option strings starting with **prefix**, in the order they were added.
+        """
+        return sorted(self.index.find(prefix))
+
+
+_option_indexes: weakref.WeakKeyDictionary[argparse.ArgumentParser, _OptionIndex] = weakref.WeakKeyDictionary()
+
+
+def _uses_prefix_index(completer: Any, validator: Callable[[str, str], bool]) -> bool:
+    # The index only answers prefix queries, and subclasses that override __call__ may complete other values
+    return (
+        validator is default_validator
+        and isinstance(completer, ChoicesCompleter)
+        and type(completer).__call__ is ChoicesCompleter.__call__
+    )
+
+
+class _CompleterRun:
+    """
+    Runs the completer of an active action, collecting the completions of generators as they are produced so that they
+    can be used if the completer doesn't finish before the deadline. Generators are not consumed further once they
+    produced more than **limit** completions accepted by **validator**.
+    """
+
+    def __init__(self, active_action: argparse.Action, completer: Any, **kwargs: Any) -> None:
+        self.active_action = active_action
+        self.completer = completer
+        self.kwargs = kwargs
+        self.output: Any = []
+        self.error: BaseException | None = None
+        self.expired = False
+        self.limited = False
+        self.finished = threading.Event()
+
+    def __call__(
+        self,
+        deadline: float | None = None,
+        limit: int | None = None,
+        validator: Callable[[str, str], bool] = default_validator,
+    ) -> None:
+        indexed = _uses_prefix_index(self.completer, validator)
+        try:
+            if indexed:
+                output = self.completer.complete_prefix(self.kwargs["prefix"])
+            elif callable(self.completer):
+                output = self.completer(**self.kwargs)
+                if isinstance(output, Mapping) or _is_async(output):
+                    self.output = output
+                    return
+            else:
+                debug("Completer is not callable, trying the readline completer protocol instead")
+                output = _readline_completions(self.completer, self.kwargs["prefix"])
+            accepted = 0
+            for completion in output:
+                self.output.append(completion)
+                if limit is not None and (indexed or validator(completion, self.kwargs["prefix"])):
+                    accepted += 1
+                    if accepted > limit:
+                        self.limited = True
+                        break
+                if deadline is not None and time.monotonic() > deadline:
+                    self.expired = True
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def completions(self) -> Any:
+        """
+        Returns the completions collected so far.
+        """
+        output = self.output
+        if self.finished.is_set() and not _is_async(output):
+            return output
+        return list(output) if isinstance(output, list) else []
+
+
+async def _await_all(
+    runs: list[_CompleterRun],
+    deadline: float | None,
+    limit: int | None = None,
+    validator: Callable[[str, str], bool] = default_validator,
+) -> None:
+    import asyncio
+
+    async def resolve(run):
+        output, run.output = run.output, []
+        if isinstance(output, AsyncGenerator):
+            # Like generators, async generators are not consumed further once they produced enough completions
+            accepted = 0
+            async for completion in output:
+                run.output.append(completion)
+                if limit is not None and validator(completion, run.kwargs["prefix"]):
+                    accepted += 1
+                    if accepted > limit:
+                        run.limited = True
+                        await output.aclose()
+                        break
+        else:
+            run.output = await output
+
+    tasks = {asyncio.ensure_future(resolve(run)): run for run in runs}
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+        tasks[task].expired = True
+    for task in done:
+        if task.exception() is not None:
+            tasks[task].error = task.exception()
+
+
+def _write_completions(output_stream: TextIO, completions: Iterable[str], ifs: str, chunk_size: int = 65536) -> int:
+    # Completions are written in chunks as they are produced, rather than joined into one string
+    chunk: list[str] = []
+    size = count = 0
+    for completion in completions:
+        chunk.append(completion if count == 0 else ifs + completion)
+        size += len(completion) + 1
+        count += 1
+        if size >= chunk_size:
+            output_stream.write("".join(chunk))
+            chunk, size = [], 0
+    output_stream.write("".join(chunk))
+    return count
+
+
 class CompletionFinder:
     """
     Inherit from this class if you wish to override any of the stages below. Otherwise, use
@@ -46,9 +319,19 @@ class CompletionFinder:
     validator: Callable[[str, str], bool]
     print_suppressed: bool
     completing: bool
-    _display_completions: dict[str, str]
+    # Descriptions are given by their action until they are needed, as computing help strings can be expensive
+    _display_completions: dict[str, str | argparse.Action]
+    _action_helps: dict[argparse.Action, str]
     default_completer: BaseCompleter
     append_space: bool
+    spec_cache: bool
+    daemon: bool | Literal["fork"]
+    completer_threads: int
+    deadline_ms: float | None
+    expired_completers: list[Any]
+    max_completions: int | None
+    convert_values: bool
+    truncated: bool
 
     active_parsers: list[argparse.ArgumentParser]
     visited_positionals: list[argparse.Action]
@@ -62,6 +345,12 @@ class CompletionFinder:
         print_suppressed: bool = False,
         default_completer: BaseCompleter = FilesCompleter(),
         append_space: bool | None = None,
+        spec_cache: bool = False,
+        daemon: bool | Literal["fork"] = False,
+        completer_threads: int = 1,
+        deadline_ms: float | None = None,
+        max_completions: int | None = None,
+        convert_values: bool = True,
     ) -> None:
         self._parser = argument_parser  # type: ignore[assignment]
         self._formatter = None
@@ -73,14 +362,35 @@ class CompletionFinder:
         self.print_suppressed = print_suppressed
         self.completing = False
         self._display_completions = {}
+        self._action_helps = {}
         self.default_completer = default_completer
         if append_space is None:
             append_space = os.environ.get("_ARGCOMPLETE_SUPPRESS_SPACE") != "1"
         self.append_space = append_space
+        self.spec_cache = spec_cache
+        self.daemon = daemon
+        self.completer_threads = completer_threads
+        if deadline_ms is None and os.environ.get("_ARC_DEADLINE_MS"):
+            try:
+                deadline_ms = float(os.environ["_ARC_DEADLINE_MS"])
+            except ValueError:
+                pass
+        self.deadline_ms = deadline_ms
+        self.expired_completers = []
+        if max_completions is None and os.environ.get("_ARC_MAX_COMPLETIONS"):
+            try:
+                max_completions = int(os.environ["_ARC_MAX_COMPLETIONS"])
+            except ValueError:
+                pass
+        self.max_completions = max_completions
+        self.convert_values = convert_values
+        self.truncated = False
+        self._request_start: float | None = None
+        self._deadline: float | None = None
 
     def __call__(
         self,
-        argument_parser: argparse.ArgumentParser,
+        argument_parser: argparse.ArgumentParser | Callable[[], argparse.ArgumentParser],
         always_complete_options: bool | str = True,
         exit_method: Callable = os._exit,
         output_stream: TextIO | None = None,
@@ -89,9 +399,17 @@ class CompletionFinder:
         print_suppressed: bool = False,
         append_space: bool | None = None,
         default_completer: BaseCompleter = FilesCompleter(),
+        spec_cache: bool = False,
+        daemon: bool | Literal["fork"] = False,
+        completer_threads: int = 1,
+        deadline_ms: float | None = None,
+        max_completions: int | None = None,
+        convert_values: bool = True,
     ) -> None:
         """
-        :param argument_parser: The argument parser to autocomplete on
+        :param argument_parser:
+            The argument parser to autocomplete on, or a function that builds and returns it. A function is only called
+            when the parser is needed, which is never the case for spec cache hits that don't involve custom completers.
         :param always_complete_options:
             Controls the autocompletion of option strings if an option string opening character (normally ``-``) has not
             been entered. If ``True`` (default), both short (``-x``) and long (``--x``) option strings will be
@@ -109,6 +427,38 @@ class CompletionFinder:
             Whether or not to autocomplete options that have the ``help=argparse.SUPPRESS`` keyword argument set.
         :param append_space:
             Whether to append a space to unique matches. The default is ``True``.
+        :param spec_cache:
+            Whether to cache a spec of the argument parser on disk (under ``$XDG_CACHE_HOME/argcomplete``) and complete
+            from it while the program, its installed distributions and the Python version remain unchanged. Actions
+            with custom completers are still completed using the live argument parser.
+        :param daemon:
+            Whether to keep serving completions from a background process after the first completion, instead of
+            running the program again for each completion (see :class:`argcomplete.daemon.CompletionServer`). If
+            ``"fork"``, the server forks a new process to complete each request (see
+            :class:`argcomplete.daemon.ForkServer`).
+        :param completer_threads:
+            Number of threads used to run completers when several of them are active (for example, for consecutive
+            positionals that could all take the word being completed). The default of ``1`` runs them one after
+            another. Completers returning awaitables (such as those with an ``async def __call__``) always run
+            concurrently on one event loop. Completions are merged in the same order either way.
+        :param deadline_ms:
+            Time budget for the completion, in milliseconds since argcomplete was called. Completers still running when
+            it runs out are abandoned, and the completions they produced so far (for example, the items already yielded
+            by a generator) are used. Completers listed in the ``expired_completers`` attribute of the finder, and in
+            the debug output, exceeded the budget. Defaults to the value of the ``_ARC_DEADLINE_MS`` environment
+            variable, or no budget if it is not set. Enforcing a budget runs completers in background threads.
+            Abandoned completers keep running in their threads until they return, which only matters in processes that
+            complete more than once: readline completion, and completion servers, which exit after such a completion.
+        :param max_completions:
+            Maximum number of completions to return. Generator completers are not consumed further once they produced
+            enough completions, and the ``truncated`` attribute of the finder is set when completions were left out.
+            zsh shows a message saying so, and fish appends it to the description of the last completion. Defaults to
+            the value of the ``_ARC_MAX_COMPLETIONS`` environment variable, or no maximum if it is not set.
+        :param convert_values:
+            Whether to convert the arguments on the command line with the ``type`` of their action, and check them
+            against its ``choices``, while parsing the command line to complete it. If ``False``, ``type`` callables
+            (including :class:`argparse.FileType`, which opens files) are never called while completing, and the
+            ``parsed_args`` seen by completers hold the strings as they were typed.
 
         .. note::
             If you are not subclassing CompletionFinder to override its behaviors,
@@ -120,20 +470,32 @@ class CompletionFinder:
         added to argcomplete.safe_actions, if their values are wanted in the ``parsed_args`` completer argument, or
         their execution is otherwise desirable.
         """
+        # The completion server calls the finder with the same options for each request
+        finder_kwargs = {
+            "always_complete_options": always_complete_options,
+            "exclude": exclude,
+            "validator": validator,
+            "print_suppressed": print_suppressed,
+            "append_space": append_space,
+            "default_completer": default_completer,
+            "spec_cache": spec_cache,
+            "completer_threads": completer_threads,
+            "deadline_ms": deadline_ms,
+            "max_completions": max_completions,
+            "convert_values": convert_values,
+        }
         self.__init__(  # type: ignore
-            argument_parser,
-            always_complete_options=always_complete_options,
-            exclude=exclude,
-            validator=validator,
-            print_suppressed=print_suppressed,
-            append_space=append_space,
-            default_completer=default_completer,
+            argument_parser if isinstance(argument_parser, argparse.ArgumentParser) else None,
+            daemon=daemon,
+            **finder_kwargs,
         )
 
         if "_ARGCOMPLETE" not in os.environ:
             # not an argument completion invocation
             return
 
+        self._request_start = time.monotonic()
+
         self._init_debug_stream()
 
         if output_stream is None:
@@ -174,6 +536,15 @@ class CompletionFinder:
         start = int(os.environ["_ARGCOMPLETE"]) - 1
         comp_words = comp_words[start:]
 
+        if self.daemon and not isinstance(argument_parser, argparse.ArgumentParser):
+            # The completion server completes with the parser built here, instead of building it for each request
+            argument_parser = functools.cache(argument_parser)
+
+        if self.spec_cache:
+            self._parser = self._load_spec_cache(argument_parser)
+        elif self._parser is None:
+            self._parser = argument_parser()  # type: ignore[operator]
+
         assert self._parser is not None
         if cword_prefix and cword_prefix[0] in self._parser.prefix_chars and "=" in cword_prefix:
             # Special case for when the current word is "--optional=PARTIAL_VALUE". Give the optional to the parser.
@@ -189,23 +560,56 @@ class CompletionFinder:
             comp_words,
         )
 
-        completions = self._get_completions(comp_words, cword_prefix, cword_prequote, last_wordbreak_pos)
-
-        if dfs:
-            display_completions = {
-                key: value.replace(ifs, " ") if value else "" for key, value in self._display_completions.items()
-            }
-            completions = [dfs.join((key, display_completions.get(key) or "")) for key in completions]
-
-        if os.environ.get("_ARGCOMPLETE_SHELL") == "zsh":
-            completions = [f"{c}:{self._display_completions.get(c)}" for c in completions]
+        try:
+            completions = self._iter_completions(comp_words, cword_prefix, cword_prequote, last_wordbreak_pos)
+        except _LiveParserRequired:
+            debug("A custom completer is required, completing with the live parser")
+            self._parser = argument_parser() if callable(argument_parser) else argument_parser
+            self._formatter = None
+            self._display_completions = {}
+            completions = self._iter_completions(comp_words, cword_prefix, cword_prequote, last_wordbreak_pos)
 
-        debug("\nReturning completions:", completions)
-        output_stream.write(ifs.join(completions))
+        count = _write_completions(output_stream, self._iter_output(completions, ifs, dfs), ifs)
+        debug("\nReturned", count, "completions")
         output_stream.flush()
         _io.debug_stream.flush()
+        if self.daemon:
+            self._spawn_daemon(argument_parser, **finder_kwargs)
         exit_method(0)
 
+    def _spawn_daemon(self, argument_parser, **finder_kwargs):
+        from .daemon import CompletionServer, ForkServer, spawn_server
+
+        server_class = ForkServer if self.daemon == "fork" else CompletionServer
+        try:
+            spawn_server(server_class(argument_parser, finder=self, finder_kwargs=finder_kwargs))
+        except OSError as e:
+            debug("Unable to start completion server:", e)
+
+    def _load_spec_cache(self, argument_parser):
+        """
+        Returns a parser rebuilt from the cached spec of the running program, refreshing the cache from the live parser
+        if needed.
+        """
+        from . import cache
+        from .spec import build_parser
+
+        fingerprint = cache.executable_fingerprint()
+        spec = cache.load_spec(fingerprint)
+        if spec is None:
+            if not isinstance(argument_parser, argparse.ArgumentParser):
+                argument_parser = argument_parser()
+            try:
+                cache.save_spec(fingerprint, self.export_spec(argument_parser))
+            except Exception as e:
+                debug("Unable to cache the spec of the parser, completing with the live parser:", e)
+            return argument_parser
+        try:
+            return build_parser(spec["parser"], lambda completer_spec: _DeferredCompleter())
+        except Exception as e:
+            debug("Unable to rebuild the parser from the cached spec, completing with the live parser:", e)
+            return argument_parser() if callable(argument_parser) else argument_parser
+
     def _init_debug_stream(self):
         """Initialize debug output stream
 
@@ -220,29 +624,91 @@ class CompletionFinder:
         debug()
 
     def _get_completions(self, comp_words, cword_prefix, cword_prequote, last_wordbreak_pos):
+        return list(self._iter_completions(comp_words, cword_prefix, cword_prequote, last_wordbreak_pos))
+
+    def _iter_completions(self, comp_words, cword_prefix, cword_prequote, last_wordbreak_pos):
+        """
+        Collects the completions, and returns an iterator that filters, truncates and quotes them one at a time as they
+        are consumed.
+        """
+        self.truncated = False
+        if self.deadline_ms is not None:
+            start = time.monotonic() if self._request_start is None else self._request_start
+            self._deadline = start + self.deadline_ms / 1000
         active_parsers = self._patch_argument_parser()
 
         parsed_args = argparse.Namespace()
         self.completing = True
+        token = _completing_finder.set(self)
 
         try:
             debug("invoking parser with", comp_words[1:])
-            with mute_stderr():
+            with mute_stderr(), completion_parse(convert_values=self.convert_values):
                 assert self._parser is not None
                 a = self._parser.parse_known_args(comp_words[1:], namespace=parsed_args)
             debug("parsed args:", a)
         except BaseException as e:
             debug("\nexception", type(e), str(e), "while parsing args")
 
+        _completing_finder.reset(token)
         self.completing = False
 
         if "--" in comp_words:
             self.always_complete_options = False
 
         completions = self.collect_completions(active_parsers, parsed_args, cword_prefix)
-        completions = self.filter_completions(completions)
-        completions = self.quote_completions(completions, cword_prequote, last_wordbreak_pos)
-        return completions
+        if self._overrides("filter_completions"):
+            filtered = iter(self.filter_completions(completions))
+        else:
+            filtered = self._iter_filtered(completions)
+        if self._overrides("quote_completions"):
+            return iter(
+                self.quote_completions(list(self._iter_truncated(filtered)), cword_prequote, last_wordbreak_pos)
+            )
+        return self._iter_quoted(self._iter_truncated(filtered), cword_prequote, last_wordbreak_pos)
+
+    def _overrides(self, method_name: str) -> bool:
+        # Methods that subclasses may override take and return lists, so they are called with the whole list
+        return getattr(type(self), method_name) is not getattr(CompletionFinder, method_name)
+
+    def _iter_truncated(self, completions: Iterator[str]) -> Iterator[str]:
+        if self.max_completions is None:
+            yield from completions
+            return
+        for i, completion in enumerate(completions):
+            if i == self.max_completions:
+                debug(f"Keeping the first {self.max_completions} completions")
+                self.truncated = True
+                return
+            yield completion
+
+    def _iter_output(self, completions: Iterator[str], ifs: str, dfs: str | None) -> Iterator[str]:
+        """
+        Formats completions for the shell, adding their descriptions. The last completion is held back until the end of
+        **completions**, so that a note can be added to it if completions were left out.
+        """
+        shell = os.environ.get("_ARGCOMPLETE_SHELL")
+        count = 0
+        previous = None
+        for completion in completions:
+            if dfs:
+                description = self._get_description(completion)
+                completion = dfs.join((completion, description.replace(ifs, " ") if description else ""))
+            if shell == "zsh":
+                completion = f"{completion}:{self._get_description(completion)}"
+            if previous is not None:
+                yield previous
+            previous = completion
+            count += 1
+        if previous is None:
+            return
+        message = f"showing the first {count} completions"
+        if self.truncated and shell == "fish" and dfs:
+            previous += f" ({message})" if not previous.endswith(dfs) else f"({message})"
+        yield previous
+        if self.truncated and shell == "zsh" and os.environ.get("_ARGCOMPLETE_MESSAGES") == "1":
+            # The shell code shows elements starting with the record separator as a message
+            yield "\x1e" + message
 
     def _patch_argument_parser(self):
         """
@@ -254,54 +720,41 @@ class CompletionFinder:
         self.active_parsers = []
         self.visited_positionals = []
 
-        completer = self
-
-        def patch(parser):
-            completer.visited_positionals.append(parser)
-            completer.active_parsers.append(parser)
-
-            if isinstance(parser, IntrospectiveArgumentParser):
-                return
-
-            classname = "MonkeyPatchedIntrospectiveArgumentParser"
-
-            parser.__class__ = type(classname, (IntrospectiveArgumentParser, parser.__class__), {})
-
-            for action in parser._actions:
-                if hasattr(action, "_orig_class"):
-                    continue
-
-                # TODO: accomplish this with super
-                class IntrospectAction(action.__class__):  # type: ignore
-                    def __call__(self, parser, namespace, values, option_string=None):
-                        debug("Action stub called on", self)
-                        debug("\targs:", parser, namespace, values, option_string)
-                        debug("\torig class:", self._orig_class)
-                        debug("\torig callable:", self._orig_callable)
-
-                        if not completer.completing:
-                            self._orig_callable(parser, namespace, values, option_string=option_string)
-                        elif issubclass(self._orig_class, argparse._SubParsersAction):
-                            debug("orig class is a subparsers action: patching and running it")
-                            patch(self._name_parser_map[values[0]])
-                            self._orig_callable(parser, namespace, values, option_string=option_string)
-                        elif self._orig_class in safe_actions:
-                            if not self.option_strings:
-                                completer.visited_positionals.append(self)
-
-                            self._orig_callable(parser, namespace, values, option_string=option_string)
-
-                action._orig_class = action.__class__
-                action._orig_callable = action.__call__
-                action.__class__ = IntrospectAction
-
-        patch(self._parser)
+        self._patch_parser(self._parser)
 
         debug("Active parsers:", self.active_parsers)
         debug("Visited positionals:", self.visited_positionals)
 
         return self.active_parsers
 
+    def _patch_parser(self, parser):
+        self.visited_positionals.append(parser)
+        self.active_parsers.append(parser)
+
+        if not isinstance(parser, IntrospectiveArgumentParser):
+            parser.__class__ = _introspective_parser_class(parser.__class__)
+
+        # Actions are only ever appended, so the parser has no new actions to patch if its last action is patched
+        if not parser._actions or hasattr(parser._actions[-1], "_orig_class"):
+            return
+        for action in parser._actions:
+            if hasattr(action, "_orig_class"):
+                continue
+            action._orig_class = action.__class__
+            action._orig_callable = action.__call__
+            action.__class__ = _introspect_action_class(action.__class__)
+
+    def _get_description(self, completion: str) -> str | None:
+        description = self._display_completions.get(completion)
+        if isinstance(description, argparse.Action):
+            # All the choices of an action share its help, so it is only computed once
+            action = description
+            description = self._action_helps.get(action)
+            if description is None:
+                description = self._action_helps[action] = self._get_action_help(action)
+            self._display_completions[completion] = description
+        return description
+
     def _get_action_help(self, action):
         if action.help is None:
             return ""
@@ -314,57 +767,64 @@ class CompletionFinder:
         return formatters._expand_help(action)
 
     def _get_subparser_completions(self, parser, cword_prefix):
-        aliases_by_parser: dict[argparse.ArgumentParser, list[str]] = {}
-        for key in parser.choices:
-            p = parser.choices[key]
-            aliases_by_parser.setdefault(p, []).append(key)
-
-        for action in parser._get_subactions():
-            for alias in aliases_by_parser[parser.choices[action.dest]]:
-                if alias.startswith(cword_prefix):
-                    self._display_completions[alias] = self._get_action_help(action)
-
-        completions = [subcmd for subcmd in parser.choices if subcmd.startswith(cword_prefix)]
+        index = _subcommand_indexes.get(parser)
+        if index is None or index.size != len(parser.choices):
+            index = _subcommand_indexes[parser] = _SubcommandIndex(parser)
+
+        completions = []
+        for i in index.find(cword_prefix):
+            name, subaction = index.names[i], index.subactions[i]
+            if subaction is not None:
+                self._display_completions[name] = subaction
+            completions.append(name)
         return completions
 
-    def _include_options(self, action, cword_prefix):
-        if len(cword_prefix) > 0 or self.always_complete_options is True:
-            return [opt for opt in action.option_strings if opt.startswith(cword_prefix)]
-        long_opts = [opt for opt in action.option_strings if len(opt) > 2]
-        short_opts = [opt for opt in action.option_strings if len(opt) <= 2]
-        if self.always_complete_options == "long":
-            return long_opts if long_opts else short_opts
-        elif self.always_complete_options == "short":
-            return short_opts if short_opts else long_opts
-        return []
-
     def _get_option_completions(self, parser, cword_prefix):
-        for action in parser._actions:
-            if action.option_strings:
-                for option_string in action.option_strings:
-                    if option_string.startswith(cword_prefix):
-                        self._display_completions[option_string] = self._get_action_help(action)
+        index = _option_indexes.get(parser)
+        if index is None or not index.is_current(parser):
+            index = _option_indexes[parser] = _OptionIndex(parser)
 
         option_completions = []
-        for action in parser._actions:
-            if not self.print_suppressed:
-                completer = getattr(action, "completer", None)
-                if isinstance(completer, SuppressCompleter) and completer.suppress():
-                    continue
-                if action.help == argparse.SUPPRESS:
-                    continue
-            if not self._action_allowed(action, parser):
+        if len(cword_prefix) > 0 or self.always_complete_options is True:
+            for i in index.find(cword_prefix):
+                option_string, action = index.option_strings[i], index.actions[i]
+                self._display_completions[option_string] = action
+                if self._option_allowed(action, parser):
+                    option_completions.append(option_string)
+            return option_completions
+
+        for option_string, action in zip(index.option_strings, index.actions):
+            self._display_completions[option_string] = action
+        if self.always_complete_options not in ("long", "short"):
+            return option_completions
+        for action, long_opts, short_opts in index.long_and_short:
+            if not self._option_allowed(action, parser):
                 continue
-            if not isinstance(action, argparse._SubParsersAction):
-                option_completions += self._include_options(action, cword_prefix)
+            if self.always_complete_options == "long":
+                option_completions += long_opts if long_opts else short_opts
+            else:
+                option_completions += short_opts if short_opts else long_opts
         return option_completions
 
+    def _option_allowed(self, action, parser):
+        if not self.print_suppressed:
+            completer = getattr(action, "completer", None)
+            if isinstance(completer, SuppressCompleter) and completer.suppress():
+                return False
+            if action.help == argparse.SUPPRESS:
+                return False
+        return self._action_allowed(action, parser)
+
     @staticmethod
     def _action_allowed(action, parser):
         # Logic adapted from take_action in ArgumentParser._parse_known_args
         # (members are saved by vendor._argparse.IntrospectiveArgumentParser)
-        for conflict_action in parser._action_conflicts.get(action, []):
-            if conflict_action in parser._seen_non_default_actions:
+        # Actions conflict if they share a mutually exclusive group. There are usually far fewer actions given than
+        # members in the groups of an action, so the groups of the given actions are searched for the action instead.
+        for seen_action in parser._seen_non_default_actions:
+            if seen_action is not action and any(
+                action in group for group in parser._mutex_groups.get(seen_action, ())
+            ):
                 return False
         return True
 
@@ -392,6 +852,7 @@ class CompletionFinder:
                 return completions
 
         complete_remaining_positionals = False
+        active_completers = []
         # Use the single greedy action (if there is one) or all active actions.
         for active_action in greedy_actions or parser.active_actions:
             if not active_action.option_strings:  # action is a positional
@@ -413,45 +874,112 @@ class CompletionFinder:
 
             if completer is None:
                 if active_action.choices is not None and not isinstance(active_action, argparse._SubParsersAction):
-                    completer = ChoicesCompleter(active_action.choices)
+                    completer = _choices_completer(active_action)
                 elif not isinstance(active_action, argparse._SubParsersAction):
                     completer = self.default_completer
 
             if completer:
                 if isinstance(completer, SuppressCompleter) and completer.suppress():
                     continue
+                active_completers.append((active_action, completer))
 
-                if callable(completer):
-                    completer_output = completer(
-                        prefix=cword_prefix, action=active_action, parser=parser, parsed_args=parsed_args
-                    )
-                    if isinstance(completer_output, Mapping):
-                        for completion, description in completer_output.items():
-                            if self.validator(completion, cword_prefix):
-                                completions.append(completion)
-                                self._display_completions[completion] = description
-                    else:
-                        for completion in completer_output:
-                            if self.validator(completion, cword_prefix):
-                                completions.append(completion)
-                                if isinstance(completer, ChoicesCompleter):
-                                    self._display_completions[completion] = self._get_action_help(active_action)
-                                else:
-                                    self._display_completions[completion] = ""
-                else:
-                    debug("Completer is not callable, trying the readline completer protocol instead")
-                    for i in range(9999):
-                        next_completion = completer.complete(cword_prefix, i)  # type: ignore
-                        if next_completion is None:
+        completer_outputs = self._run_completers(active_completers, cword_prefix, parser, parsed_args)
+        for (active_action, completer), completer_output in zip(active_completers, completer_outputs):
+            if self._over_limit(completions):
+                break
+            # Completions looked up in a prefix index already match
+            indexed = _uses_prefix_index(completer, self.validator)
+            if isinstance(completer_output, Mapping):
+                for completion, description in completer_output.items():
+                    if self.validator(completion, cword_prefix):
+                        completions.append(completion)
+                        self._display_completions[completion] = description
+                        if self._over_limit(completions):
+                            break
+            else:
+                for completion in completer_output:
+                    if indexed or self.validator(completion, cword_prefix):
+                        completions.append(completion)
+                        if isinstance(completer, ChoicesCompleter):
+                            self._display_completions[completion] = active_action
+                        else:
+                            self._display_completions[completion] = ""
+                        if self._over_limit(completions):
                             break
-                        if self.validator(next_completion, cword_prefix):
-                            self._display_completions[next_completion] = ""
-                            completions.append(next_completion)
-                if optional_prefix:
-                    completions = [optional_prefix + "=" + completion for completion in completions]
-                debug("Completions:", completions)
+            if optional_prefix:
+                completions = [optional_prefix + "=" + completion for completion in completions]
+            debug("Completions:", completions)
         return completions
 
+    def _over_limit(self, completions: list[str]) -> bool:
+        return self.max_completions is not None and len(completions) > self.max_completions
+
+    def _run_completers(self, active_completers, cword_prefix, parser, parsed_args):
+        """
+        Runs the completers of the active actions, in threads if ``completer_threads`` or a deadline requires it, and
+        returns their outputs in the same order. Awaitable outputs are awaited together on one event loop.
+        """
+        runs = [
+            _CompleterRun(
+                active_action,
+                completer,
+                prefix=cword_prefix,
+                action=active_action,
+                parser=parser,
+                parsed_args=parsed_args,
+            )
+            for active_action, completer in active_completers
+        ]
+        if self._deadline is None and (self.completer_threads <= 1 or len(runs) <= 1):
+            for run in runs:
+                run(self._deadline, self.max_completions, self.validator)
+                if run.limited:
+                    # The completions of later completers would be cut off anyway
+                    break
+        else:
+            self._run_in_threads(runs)
+
+        pending = [run for run in runs if run.finished.is_set() and _is_async(run.output)]
+        if pending:
+            debug("Awaiting", len(pending), "asynchronous completers")
+            import asyncio
+
+            asyncio.run(_await_all(pending, self._deadline, self.max_completions, self.validator))
+
+        for run in runs:
+            if run.error is not None:
+                raise run.error
+            if run.expired:
+                debug(
+                    f"Completer {run.completer!r} for {run.active_action.dest} exceeded the deadline of "
+                    f"{self.deadline_ms} ms, using the {len(run.completions())} completions it produced in time"
+                )
+                self.expired_completers.append(run.completer)
+            if run.limited:
+                self.truncated = True
+        return [run.completions() for run in runs]
+
+    def _run_in_threads(self, runs):
+        # Threads are daemonic, so that completers still running at the deadline don't keep the process alive
+        deadline = self._deadline
+        queue = iter(runs)
+        lock = threading.Lock()
+
+        def worker():
+            while deadline is None or time.monotonic() < deadline:
+                with lock:
+                    run = next(queue, None)
+                if run is None:
+                    return
+                run(deadline, self.max_completions, self.validator)
+
+        for _ in range(max(1, min(self.completer_threads, len(runs)))):
+            threading.Thread(target=worker, daemon=True).start()
+        for run in runs:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not run.finished.wait(timeout):
+                run.expired = True
+
     def collect_completions(
         self, active_parsers: list[argparse.ArgumentParser], parsed_args: argparse.Namespace, cword_prefix: str
     ) -> list[str]:
@@ -508,23 +1036,32 @@ class CompletionFinder:
 
         return None
 
-    def filter_completions(self, completions: list[str]) -> list[str]:
+    def filter_completions(self, completions: Iterable[str]) -> list[str]:
         """
         De-duplicates completions and excludes those specified by ``exclude``.
         Returns the filtered completions as a list.
 
         This method is exposed for overriding in subclasses; there is no need to use it directly.
         """
-        filtered_completions = []
+        return list(self._iter_filtered(completions))
+
+    def _iter_filtered(self, completions: Iterable[str]) -> Iterator[str]:
+        exclude: Container[str] = ()
+        if isinstance(self.exclude, (set, frozenset, dict)):
+            exclude = self.exclude
+        elif isinstance(self.exclude, Iterable) and not isinstance(self.exclude, str):
+            exclude = frozenset(self.exclude)
+        elif self.exclude is not None:
+            exclude = self.exclude
+        seen: set[str] = set()
         for completion in completions:
-            if self.exclude is not None and completion in self.exclude:
+            if completion in seen or completion in exclude:
                 continue
-            if completion not in filtered_completions:
-                filtered_completions.append(completion)
-        return filtered_completions
+            seen.add(completion)
+            yield completion
 
     def quote_completions(
-        self, completions: list[str], cword_prequote: str, last_wordbreak_pos: int | None
+        self, completions: Iterable[str], cword_prequote: str, last_wordbreak_pos: int | None
     ) -> list[str]:
         """
         If the word under the cursor started with a quote (as indicated by a nonempty ``cword_prequote``), escapes
@@ -537,57 +1074,47 @@ class CompletionFinder:
 
         This method is exposed for overriding in subclasses; there is no need to use it directly.
         """
-        special_chars = "\\"
+        return list(self._iter_quoted(completions, cword_prequote, last_wordbreak_pos))
+
+    def _iter_quoted(
+        self, completions: Iterable[str], cword_prequote: str, last_wordbreak_pos: int | None
+    ) -> Iterator[str]:
         # If the word under the cursor was quoted, escape the quote char.
         # Otherwise, escape all special characters and specially handle all COMP_WORDBREAKS chars.
-        if cword_prequote == "":
+        if cword_prequote == "" and last_wordbreak_pos is not None:
             # Bash mangles completions which contain characters in COMP_WORDBREAKS.
             # This workaround has the same effect as __ltrim_colon_completions in bash_completion
             # (extended to characters other than the colon).
-            if last_wordbreak_pos is not None:
-                completions = [c[last_wordbreak_pos + 1 :] for c in completions]
-            special_chars += "();<>|&!`$*?[]{} \t\n\"'"
-        elif cword_prequote == '"':
-            special_chars += '"`$!'
-
-        if os.environ.get("_ARGCOMPLETE_SHELL") in ("tcsh", "fish"):
-            # tcsh and fish escapes special characters itself.
-            special_chars = ""
-        elif cword_prequote == "'":
-            # Nothing can be escaped in single quotes, so we need to close
-            # the string, escape the single quote, then open a new string.
-            special_chars = ""
-            completions = [c.replace("'", r"'\''") for c in completions]
-
-        # PowerShell uses ` as escape character.
-        if os.environ.get("_ARGCOMPLETE_SHELL") == "powershell":
-            escape_char = '`'
-            special_chars = special_chars.replace('`', '')
-        else:
-            escape_char = "\\"
-            if os.environ.get("_ARGCOMPLETE_SHELL") == "zsh":
-                # zsh uses colon as a separator between a completion and its description.
-                special_chars += ":"
-
-        escaped_completions = []
-        for completion in completions:
-            escaped_completion = completion
-            for char in special_chars:
-                escaped_completion = escaped_completion.replace(char, escape_char + char)
-            escaped_completions.append(escaped_completion)
-            if completion in self._display_completions:
-                self._display_completions[escaped_completion] = self._display_completions[completion]
-
-        if self.append_space:
-            # Similar functionality in bash was previously turned off by supplying the "-o nospace" option to complete.
-            # Now it is conditionally disabled using "compopt -o nospace" if the match ends in a continuation character.
-            # This code is retained for environments where this isn't done natively.
-            continuation_chars = "=/:"
-            if len(escaped_completions) == 1 and escaped_completions[0][-1] not in continuation_chars:
-                if cword_prequote == "":
-                    escaped_completions[0] += " "
-
-        return escaped_completions
+            completions = (c[last_wordbreak_pos + 1 :] for c in completions)
+        escape = get_dialect(os.environ.get("_ARGCOMPLETE_SHELL")).escaper(cword_prequote)
+        display_completions = self._display_completions
+
+        def escape_completions():
+            for completion in completions:
+                escaped_completion = escape(completion)
+                if escaped_completion != completion and completion in display_completions:
+                    display_completions[escaped_completion] = display_completions[completion]
+                yield escaped_completion
+
+        escaped_completions = escape_completions()
+        # Look ahead to find out whether there is only one completion
+        first = next(escaped_completions, None)
+        if first is None:
+            return
+        second = next(escaped_completions, None)
+        if second is None:
+            if self.append_space:
+                # Similar functionality in bash was previously turned off by supplying the "-o nospace" option to
+                # complete. Now it is conditionally disabled using "compopt -o nospace" if the match ends in a
+                # continuation character. This code is retained for environments where this isn't done natively.
+                continuation_chars = "=/:"
+                if first[-1] not in continuation_chars and cword_prequote == "":
+                    first += " "
+            yield first
+            return
+        yield first
+        yield second
+        yield from escaped_completions
 
     def rl_complete(self, text: str, state: int) -> str | None:
         """
@@ -621,7 +1148,25 @@ class CompletionFinder:
         """
         This function returns a mapping of completions to their help strings for displaying to the user.
         """
-        return self._display_completions
+        for completion in self._display_completions:
+            self._get_description(completion)
+        return cast(dict[str, str], self._display_completions)
+
+    def export_spec(self, argument_parser: argparse.ArgumentParser | None = None) -> dict:
+        """
+        Walks the argument parser tree and returns a versioned, JSON-serializable completion spec describing every
+        parser, subcommand (with aliases), option string, ``nargs`` value, choices, help string, suppression state and
+        mutually exclusive group. Custom completers are described by an importable ``module:qualname`` reference.
+
+        Help strings are rendered the same way as the display completions produced by this finder.
+        """
+        from .spec import SPEC_VERSION, parser_spec
+
+        if argument_parser is not None:
+            self._parser = argument_parser
+            self._formatter = None
+        assert self._parser is not None
+        return {"version": SPEC_VERSION, "parser": parser_spec(self._parser, self._get_action_help)}
 
 
 class ExclusiveCompletionFinder(CompletionFinder):
@@ -0,0 +1,68 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+# This file contains support for subcommands whose arguments are only added when the subcommand is used.
+
+from __future__ import annotations
+
+import argparse
+from collections.abc import Callable
+from typing import Any
+
+
+class _LazyParserMap(dict):
+    """
+    Maps subcommand names to their parsers, adding the arguments of a parser the first time it is looked up. Checking
+    or listing the names doesn't add any arguments.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.factories: dict[int, Callable[[argparse.ArgumentParser], Any]] = {}
+
+    def __getitem__(self, name: str) -> argparse.ArgumentParser:
+        parser = super().__getitem__(name)
+        factory = self.factories.pop(id(parser), None)
+        if factory is not None:
+            factory(parser)
+        return parser
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+
+class LazySubParsersAction(argparse._SubParsersAction):
+    """
+    A subparsers action whose subcommands can be added with :meth:`add_lazy_parser`, so that their arguments are only
+    added when a command line (or a completion) actually uses them. Use it by passing it to ``add_subparsers``:
+
+    .. code-block:: python
+
+        subparsers = parser.add_subparsers(action=argcomplete.LazySubParsersAction)
+        subparsers.add_lazy_parser("deploy", add_deploy_arguments, help="deploy the application")
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._name_parser_map = self.choices = _LazyParserMap()
+
+    def add_lazy_parser(
+        self, name: str, factory: Callable[[argparse.ArgumentParser], Any], **kwargs: Any
+    ) -> argparse.ArgumentParser:
+        """
+        Adds a subcommand like ``add_parser``, and returns its parser without any arguments. When the subcommand is
+        used, **factory** is called with the parser to add its arguments.
+        """
+        parser = self.add_parser(name, **kwargs)
+        assert isinstance(self._name_parser_map, _LazyParserMap)
+        self._name_parser_map.factories[id(parser)] = factory
+        return parser
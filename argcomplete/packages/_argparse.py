@@ -20,6 +20,9 @@ from argparse import (
     _get_action_name,
     _SubParsersAction,
 )
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from gettext import gettext
 from typing import cast
 
@@ -28,6 +31,28 @@ _OptionTupleEntry = _OptionTuple | list[_OptionTuple]
 
 _num_consumed_args: dict[Action, int] = {}
 
+_completing: ContextVar[bool] = ContextVar("_completing", default=False)
+_convert_values: ContextVar[bool] = ContextVar("_convert_values", default=True)
+
+
+class CompletionParseError(Exception):
+    '''Raised instead of printing the usage and exiting when a parse of a command line being completed fails.'''
+
+
+@contextmanager
+def completion_parse(convert_values: bool = True) -> Iterator[None]:
+    '''Marks the parses done while the context is active as parses of a command line being completed.
+    Errors raise CompletionParseError without formatting the usage. If convert_values is False, argument strings are
+    neither converted with the type of their action nor checked against its choices.
+    '''
+    completing_token = _completing.set(True)
+    convert_values_token = _convert_values.set(convert_values)
+    try:
+        yield
+    finally:
+        _convert_values.reset(convert_values_token)
+        _completing.reset(completing_token)
+
 
 def action_is_satisfied(action):
     '''Returns False if the parse would raise an error if no more arguments are given to this action, True otherwise.'''
@@ -75,6 +100,33 @@ def action_is_greedy(action, isoptional=False):
         return action.nargs == REMAINDER and num_consumed_args >= 1
 
 
+_MAX_CACHED_OPTIONALS = 1024
+
+
+class _ParseTables:
+    '''The parts of the parse setup that only depend on the actions of a parser, kept between parses so that repeated
+    completions with the same parser skip them. They are rebuilt when actions or mutually exclusive groups are added.
+    '''
+
+    def __init__(self, parser, key):
+        self.key = key
+        # map all mutually exclusive arguments to the other arguments
+        # they can't occur with
+        self.action_conflicts: dict[Action, list[Action]] = {}
+        # The members of the mutually exclusive groups of each action, for finding conflicts without scanning them
+        self.mutex_groups: dict[Action, list[frozenset[Action]]] = {}
+        for mutex_group in parser._mutually_exclusive_groups:
+            group_actions = mutex_group._group_actions
+            members = frozenset(group_actions)
+            for i, mutex_action in enumerate(mutex_group._group_actions):
+                conflicts = self.action_conflicts.setdefault(mutex_action, [])
+                conflicts.extend(group_actions[:i])
+                conflicts.extend(group_actions[i + 1 :])
+                self.mutex_groups.setdefault(mutex_action, []).append(members)
+        # The results of _parse_optional, by argument string
+        self.optionals: dict[str, _OptionTupleEntry | None] = {}
+
+
 class IntrospectiveArgumentParser(ArgumentParser):
     '''The following is a verbatim copy of ArgumentParser._parse_known_args (Python 2.7.3),
     except for the lines that contain the string "Added by argcomplete".
@@ -90,14 +142,10 @@ class IntrospectiveArgumentParser(ArgumentParser):
 
         # map all mutually exclusive arguments to the other arguments
         # they can't occur with
-        action_conflicts: dict[Action, list[Action]] = {}
+        tables = self._get_parse_tables()  # Added by argcomplete
+        action_conflicts = tables.action_conflicts  # Added by argcomplete
         self._action_conflicts = action_conflicts  # Added by argcomplete
-        for mutex_group in self._mutually_exclusive_groups:
-            group_actions = mutex_group._group_actions
-            for i, mutex_action in enumerate(mutex_group._group_actions):
-                conflicts = action_conflicts.setdefault(mutex_action, [])
-                conflicts.extend(group_actions[:i])
-                conflicts.extend(group_actions[i + 1 :])
+        self._mutex_groups = tables.mutex_groups  # Added by argcomplete
 
         # find all option indices, and determine the arg_string_pattern
         # which has an 'O' if there is an option at an index,
@@ -346,3 +394,42 @@ class IntrospectiveArgumentParser(ArgumentParser):
 
         # return the updated namespace and the extra arguments
         return namespace, extras
+
+    # Begin added by argcomplete
+    def _get_parse_tables(self):
+        actions = self._actions
+        key = (len(actions), actions[-1] if actions else None, len(self._mutually_exclusive_groups), self.allow_abbrev)
+        tables = self.__dict__.get('_argcomplete_parse_tables')
+        if tables is None or tables.key != key:
+            tables = self._argcomplete_parse_tables = _ParseTables(self, key)
+        return tables
+
+    def _parse_optional(self, arg_string):
+        optionals = self._get_parse_tables().optionals
+        try:
+            return optionals[arg_string]
+        except KeyError:
+            pass
+        option_tuple = super()._parse_optional(arg_string)
+        if len(optionals) >= _MAX_CACHED_OPTIONALS:
+            optionals.clear()
+        optionals[arg_string] = option_tuple
+        return option_tuple
+
+    def error(self, message):
+        # The usage would be formatted only to be discarded
+        if _completing.get():
+            raise CompletionParseError(message)
+        super().error(message)
+
+    def _get_value(self, action, arg_string):
+        if not _convert_values.get():
+            return arg_string
+        return super()._get_value(action, arg_string)
+
+    def _check_value(self, action, value):
+        # Unknown subcommands still end the parse, as there is no parser to continue with
+        if _convert_values.get() or isinstance(action, _SubParsersAction):
+            super()._check_value(action, value)
+
+    # End added by argcomplete
@@ -21,19 +21,45 @@ For Tcsh
 For Fish
 
     $ register-python-argcomplete --shell fish my-favourite-script.py > ~/.config/fish/my-favourite-script.py.fish
+
+For bash, using static completion tables that don't run my-favorite-script.py unless a custom completer is needed
+
+    $ eval "$(register-python-argcomplete --static my_package.cli:get_parser my-favorite-script.py)"
+
+For zsh, using a static completion function built from _arguments
+
+    $ register-python-argcomplete --shell zsh --static my_package.cli:get_parser my-favorite-script.py \
+        > ~/.zfunc/_my-favorite-script.py
+
+To export a static completion spec for a parser (an ArgumentParser or a function returning one)
+
+    $ register-python-argcomplete --export-spec my_package.cli:get_parser > my-favorite-script.json
 """
 
 from __future__ import annotations
 
 import argparse
+import json
+import os
 import sys
 
 import argcomplete
+from argcomplete.spec import resolve_reference
 
 # PEP 366
 __package__ = "argcomplete.scripts"
 
 
+def get_spec(reference: str) -> dict:
+    if os.path.isfile(reference):
+        with open(reference) as fh:
+            return json.load(fh)
+    target = resolve_reference(reference)
+    if not isinstance(target, argparse.ArgumentParser):
+        target = target()
+    return argcomplete.CompletionFinder().export_spec(target)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
 
@@ -60,7 +86,20 @@ def main() -> None:
         "-e", "--external-argcomplete-script", help="external argcomplete script for auto completion of the executable"
     )
 
-    parser.add_argument("executable", nargs="+", help="executable to completed (when invoked by exactly this name)")
+    parser.add_argument(
+        "--export-spec",
+        metavar="MODULE:PARSER",
+        help="print the completion spec of the given argument parser (or function returning one) as JSON",
+    )
+    parser.add_argument(
+        "--static",
+        metavar="MODULE:PARSER",
+        help="output native completion code built from the given argument parser (or function returning one, or a spec "
+        "file written by --export-spec), which only runs the executable for arguments with custom completers (affects "
+        "bash, zsh and fish only)",
+    )
+
+    parser.add_argument("executable", nargs="*", help="executable to completed (when invoked by exactly this name)")
 
     argcomplete.autocomplete(parser)
 
@@ -70,9 +109,23 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    if args.export_spec:
+        json.dump(get_spec(args.export_spec), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+
+    if not args.executable:
+        parser.error("the following arguments are required: executable")
+
     sys.stdout.write(
         argcomplete.shellcode(
-            args.executable, args.use_defaults, args.shell, args.complete_arguments, args.external_argcomplete_script
+            args.executable,
+            args.use_defaults,
+            args.shell,
+            args.complete_arguments,
+            args.external_argcomplete_script,
+            static=args.static is not None,
+            spec=get_spec(args.static) if args.static else None,
         )
     )
 
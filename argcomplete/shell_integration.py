@@ -5,11 +5,16 @@
 
 from __future__ import annotations
 
-from collections.abc import Iterable
+import argparse
+import re
+from collections.abc import Iterable, Mapping
 from shlex import quote
+from typing import Any
 
-bashcode = r"""#compdef %(executables)s
-# Run something, muting output or redirecting it to the debug stream
+from .spec import SPEC_VERSION
+
+# Functions shared by the bash and zsh code, which run the program to get completions
+_bash_functions_code = r"""# Run something, muting output or redirecting it to the debug stream
 # depending on the value of _ARC_DEBUG.
 # If ARGCOMPLETE_USE_TEMPFILES is set, use tempfiles for IPC.
 __python_argcomplete_run() {
@@ -27,6 +32,16 @@ __python_argcomplete_run() {
 
 __python_argcomplete_run_inner() {
     if [[ -z "${_ARC_DEBUG-}" ]]; then
+        # Ask a completion server (see argcomplete.daemon) for completions, if one was started for the command
+        local daemon_dir="${XDG_RUNTIME_DIR:+$XDG_RUNTIME_DIR/argcomplete}" target="$1"
+        daemon_dir="${daemon_dir:-/tmp/argcomplete-$UID}"
+        if [[ "${target##*/}" == python* && $# -gt 1 ]]; then
+            target="${@:$#}"
+        fi
+        if [[ -O "$daemon_dir" && -O "$daemon_dir/${target##*/}.sock" && -O "$daemon_dir/client" ]] &&
+            "$daemon_dir/client" "$@" 8>&1 9>/dev/null 1>/dev/null 2>&1 </dev/null; then
+            return
+        fi
         "$@" 8>&1 9>&2 1>/dev/null 2>&1 </dev/null
     else
         "$@" 8>&1 9>&2 1>&9 2>&1 </dev/null
@@ -44,7 +59,12 @@ _python_argcomplete%(function_suffix)s() {
             _ARGCOMPLETE=1 \
             _ARGCOMPLETE_SHELL="zsh" \
             _ARGCOMPLETE_SUPPRESS_SPACE=1 \
+            _ARGCOMPLETE_MESSAGES=1 \
             __python_argcomplete_run ${script:-${words[1]}}))
+        if [[ "${completions[-1]-}" == $'\x1e'* ]]; then
+            _message -r "${completions[-1]#$'\x1e'}"
+            completions[-1]=()
+        fi
         local nosort=()
         local nospace=()
         if is-at-least 5.8; then
@@ -75,7 +95,12 @@ _python_argcomplete%(function_suffix)s() {
         fi
     fi
 }
-if [[ -z "${ZSH_VERSION-}" ]]; then
+"""
+
+bashcode = (
+    "#compdef %(executables)s\n"
+    + _bash_functions_code
+    + r"""if [[ -z "${ZSH_VERSION-}" ]]; then
     complete %(complete_opts)s -F _python_argcomplete%(function_suffix)s %(executables)s
 else
     # When called by the Zsh completion system, this will end with
@@ -90,12 +115,284 @@ else
     fi
 fi
 """
+)
+
+bash_static_code = r"""
+# Static completion tables generated from the parser spec. Actions and parsers are identified by number.
+%(function)s_option() {
+    case "$1 $2" in
+%(option_cases)s
+        *) return 1 ;;
+    esac
+}
+
+%(function)s_positional() {
+    case "$1 $2" in
+%(positional_cases)s
+        *) return 1 ;;
+    esac
+}
+
+%(function)s_subcommand() {
+    case "$1 $2" in
+%(subcommand_cases)s
+        *) return 1 ;;
+    esac
+}
+
+%(function)s_nargs() {
+    case $1 in
+%(nargs_cases)s
+        *) REPLY=0 ;;
+    esac
+}
+
+%(function)s_prefix_chars() {
+    case $1 in
+%(prefix_chars_cases)s
+        *) REPLY=- ;;
+    esac
+}
+
+%(function)s_conflicts() {
+    case $1 in
+%(conflicts_cases)s
+        *) REPLY= ;;
+    esac
+}
+
+%(function)s_options() {
+    case $1 in
+%(options_cases)s
+        *) REPLY=() ;;
+    esac
+}
+
+%(function)s_values() {
+    case $1 in
+%(values_cases)s
+        *) kind=none ;;
+    esac
+}
+
+%(function)s_add_values() {
+    local c kind
+    %(function)s_values "$1"
+    case $kind in
+        words)
+            for c in "${REPLY[@]}"; do
+                if [[ $c == "$2"* ]]; then
+                    cands+=("${3-}$c")
+                fi
+            done ;;
+        files|dirs)
+            filenames=1
+            [[ $kind == files ]] && kind=-f || kind=-d
+            while IFS= read -r c; do
+                cands+=("${3-}$c")
+            done < <(compgen $kind -- "$2") ;;
+        none) ;;
+        *) return 1 ;;
+    esac
+}
+
+%(function)s_add_options() {
+    local aid blocked=" " i
+    for aid in $seen; do
+        %(function)s_conflicts "$aid"
+        blocked+=$REPLY
+    done
+    %(function)s_options "$pid"
+    for (( i=0; i < ${#REPLY[@]}; i+=2 )); do
+        if [[ ${REPLY[i+1]} == "$1"* && $blocked != *" ${REPLY[i]} "* ]]; then
+            cands+=("${REPLY[i+1]}")
+        fi
+    done
+}
+
+%(function)s_is_option() {
+    [[ ${#1} -gt 1 && $pfx == *"${1:0:1}"* ]]
+}
+
+%(function)s() {
+    local IFS=$' \t\n' REPLY cur w i aid pid=0 pos=0 pcount=0 pfx=- dashdash= seen=" " filenames= head
+    local opt_aid= opt_left=0 opt_nargs= opt_count=0
+    local -a words=() cands=()
+    # Reassemble words that bash split at "=" and ":" (COMP_WORDBREAKS), like __reassemble_comp_words_by_ref
+    for (( i=0; i <= COMP_CWORD; i++ )); do
+        w=${COMP_WORDS[i]}
+        if (( ${#words[@]} > 1 )) && [[ -n $w ]] && [[ $w == [=:] || ${words[${#words[@]}-1]} == *[=:] ]]; then
+            words[${#words[@]}-1]+=$w
+        else
+            words+=("$w")
+        fi
+    done
+    cur=${words[${#words[@]}-1]}
+    if [[ $cur == [\"\']* ]]; then
+        %(dynamic_function)s "$@"
+        return
+    fi
+    %(function)s_prefix_chars 0
+    pfx=$REPLY
+
+    for (( i=1; i < ${#words[@]}-1; i++ )); do
+        w=${words[i]}
+        if [[ -n $opt_aid ]]; then
+            if (( opt_left > 0 )); then
+                (( --opt_left )) || opt_aid=
+                continue
+            fi
+            if ! %(function)s_is_option "$w"; then
+                # Options with a variable number of arguments consume words until the next option
+                [[ $opt_nargs == "?" ]] && opt_aid=
+                (( ++opt_count ))
+                continue
+            fi
+            opt_aid=
+        fi
+        if [[ -z $dashdash && $w == -- ]]; then
+            dashdash=1
+            continue
+        fi
+        if [[ -z $dashdash ]] && %(function)s_is_option "$w"; then
+            if ! %(function)s_option "$pid" "${w/=*/}"; then
+                %(dynamic_function)s "$@"
+                return
+            fi
+            aid=$REPLY
+            seen+="$aid "
+            [[ $w == *=* ]] && continue
+            %(function)s_nargs "$aid"
+            case $REPLY in
+                0) ;;
+                [1-9]*) opt_aid=$aid opt_left=$REPLY opt_nargs= ;;
+                [?*+]) opt_aid=$aid opt_left=0 opt_nargs=$REPLY opt_count=0 ;;
+                *) %(dynamic_function)s "$@"; return ;;
+            esac
+            continue
+        fi
+        %(function)s_positional "$pid" "$pos" || continue
+        aid=$REPLY
+        seen+="$aid "
+        %(function)s_nargs "$aid"
+        case $REPLY in
+            A...)
+                if ! %(function)s_subcommand "$aid" "$w"; then
+                    %(dynamic_function)s "$@"
+                    return
+                fi
+                pid=$REPLY pos=0 pcount=0 seen=" "
+                %(function)s_prefix_chars "$pid"
+                pfx=$REPLY ;;
+            [?]) (( ++pos )) ;;
+            [*+]) (( ++pcount )) ;;
+            [1-9]*) (( ++pcount < REPLY )) || (( ++pos, pcount=0 )) ;;
+            *) %(dynamic_function)s "$@"; return ;;
+        esac
+    done
+
+    if [[ -n $opt_aid ]] && { (( opt_left > 0 )) || [[ $opt_nargs$opt_count == +0 ]]; }; then
+        # The option must consume the word under the cursor
+        %(function)s_add_values "$opt_aid" "$cur" || { %(dynamic_function)s "$@"; return; }
+    elif [[ -z $dashdash && -n $cur && $pfx == *"${cur:0:1}"* ]]; then
+        if [[ $cur == *=* ]]; then
+            if ! %(function)s_option "$pid" "${cur/=*/}" ||
+                ! %(function)s_add_values "$REPLY" "${cur#*=}" "${cur/=*/}="; then
+                %(dynamic_function)s "$@"
+                return
+            fi
+        else
+            %(function)s_add_options "$cur"
+        fi
+    else
+        if [[ -n $opt_aid ]]; then
+            %(function)s_add_values "$opt_aid" "$cur" || { %(dynamic_function)s "$@"; return; }
+        fi
+        if [[ -z $dashdash && -z $cur ]]; then
+            %(function)s_add_options ""
+        fi
+        if %(function)s_positional "$pid" "$pos"; then
+            %(function)s_add_values "$REPLY" "$cur" || { %(dynamic_function)s "$@"; return; }
+        fi
+    fi
+
+    # Drop the part of the word before the last "=" or ":", which bash considers a separate word
+    w=${cur##*[=:]}
+    head=$(( ${#cur} - ${#w} ))
+    COMPREPLY=()
+    for w in "${cands[@]}"; do
+        w=${w:head}
+        if [[ -z $filenames && $w == *[^A-Za-z0-9_./:=@+,-]* ]]; then
+            printf -v w '%%q' "$w"
+        fi
+        COMPREPLY+=("$w")
+    done
+    if [[ -n $filenames ]]; then
+        compopt -o filenames 2> /dev/null
+    fi
+    if compopt +o nospace 2> /dev/null; then
+        if [[ ${#COMPREPLY[@]} == 1 && "${COMPREPLY-}" =~ [=/:]$ ]]; then
+            compopt -o nospace
+        fi
+    elif [[ ${#COMPREPLY[@]} == 1 && ! "${COMPREPLY-}" =~ [=/:]$ ]]; then
+        COMPREPLY[0]+=" "
+    fi
+}
+complete %(complete_opts)s -F %(function)s %(executables)s
+"""
+
+zsh_static_code = (
+    r"""#compdef %(executables)s
+autoload is-at-least
+"""
+    + _bash_functions_code
+    + r"""
+%(function)s_dynamic() {
+    # Restore the command line as it was before _arguments consumed it, and let the program complete it
+    words=("${_arc_words[@]}") CURRENT=$_arc_current
+    IPREFIX=$_arc_iprefix PREFIX=$_arc_prefix SUFFIX=$_arc_suffix ISUFFIX=$_arc_isuffix
+    %(dynamic_function)s
+}
+
+%(parser_functions)s
+%(function)s() {
+    local -a _arc_words
+    local _arc_current=$CURRENT _arc_iprefix=$IPREFIX _arc_prefix=$PREFIX _arc_suffix=$SUFFIX _arc_isuffix=$ISUFFIX
+    _arc_words=("${words[@]}")
+    %(function)s_0
+}
+# See the end of bashcode for how the completion function is invoked or registered
+if [[ $zsh_eval_context == *func ]]; then
+    %(function)s "$@"
+else
+    compdef %(function)s %(executables)s
+fi
+"""
+)
+
+zsh_static_parser_code = r"""%(function)s_%(parser_id)s() {
+    local curcontext="$curcontext" state state_descr line ret=1
+    typeset -A opt_args
+    _arguments -s -S -C : \
+%(specs)s && ret=0
+%(subcommand_dispatch)s    return ret
+}
+"""
+
+zsh_static_subcommand_code = r"""    if [[ $state == subcommand ]]; then
+        case $words[1] in
+%(subcommand_cases)s
+            (*) %(function)s_dynamic && ret=0 ;;
+        esac
+    fi
+"""
 
 tcshcode = """\
 complete "%(executable)s" 'p@*@`python-argcomplete-tcsh "%(argcomplete_script)s"`@' ;
 """
 
-fishcode = r"""
+# The function that runs the program to get completions, shared by the dynamic and static fish code
+_fish_function_code = r"""
 function __fish_%(function_name)s_complete
     set -lx _ARGCOMPLETE 1
     set -lx _ARGCOMPLETE_DFS \t
@@ -111,7 +408,34 @@ function __fish_%(function_name)s_complete
         %(argcomplete_script)s 8>&1 9>&2 1>/dev/null 2>&1
     end
 end
-complete %(completion_arg)s %(executable)s -f -a '(__fish_%(function_name)s_complete)'
+"""
+
+fishcode = (
+    _fish_function_code
+    + r"""complete %(completion_arg)s %(executable)s -f -a '(__fish_%(function_name)s_complete)'
+"""
+)
+
+fish_static_code = r"""
+function __fish_%(function_name)s_static_parser
+    # Follow the subcommands on the command line to find the parser that completes the current word
+    set -l parser 0
+    set -l tokens (commandline -opc)
+    set -e tokens[1]
+    for token in $tokens
+        switch "$parser $token"
+%(subcommand_cases)s
+        end
+    end
+    echo $parser
+end
+
+function __fish_%(function_name)s_static_using_parser
+    test (__fish_%(function_name)s_static_parser) = $argv[1]
+end
+
+complete %(completion_arg)s %(executable)s -f
+%(completions)s
 """
 
 powershell_code = r"""
@@ -138,12 +462,392 @@ Register-ArgumentCompleter -Native -CommandName %(executable)s -ScriptBlock {
 shell_codes = {"bash": bashcode, "tcsh": tcshcode, "fish": fishcode, "powershell": powershell_code}
 
 
+class _StaticTables:
+    """
+    Flattens a parser spec into numbered parsers and actions for the static shellcode generators.
+    """
+
+    def __init__(self, spec: Mapping[str, Any]) -> None:
+        if spec.get("version") != SPEC_VERSION:
+            raise ValueError(f"Unsupported completion spec version: {spec.get('version')!r}")
+        self.parsers: list[Mapping[str, Any]] = []
+        self.actions: list[Mapping[str, Any]] = []
+        self.parser_actions: list[list[int]] = []
+        self.subcommands: dict[int, list[tuple[list[str], str | None, int]]] = {}
+        self.conflicts: dict[int, set[int]] = {}
+        self._add_parser(spec["parser"])
+
+    def _add_parser(self, parser: Mapping[str, Any]) -> int:
+        parser_id = len(self.parsers)
+        self.parsers.append(parser)
+        action_ids = list(range(len(self.actions), len(self.actions) + len(parser["actions"])))
+        self.parser_actions.append(action_ids)
+        self.actions.extend(parser["actions"])
+        for group in parser["mutually_exclusive_groups"]:
+            members = [action_ids[i] for i in group["actions"]]
+            for action_id in members:
+                self.conflicts.setdefault(action_id, set()).update(m for m in members if m != action_id)
+        for action_id, action in zip(action_ids, parser["actions"]):
+            if "subcommands" in action:
+                self.subcommands[action_id] = [
+                    ([sub["name"], *sub["aliases"]], sub["help"], self._add_parser(sub["parser"]))
+                    for sub in action["subcommands"]
+                ]
+        return parser_id
+
+    def options(self, parser_id: int) -> list[tuple[int, str]]:
+        return [
+            (action_id, option_string)
+            for action_id in self.parser_actions[parser_id]
+            if not self.actions[action_id]["suppressed"]
+            for option_string in self.actions[action_id]["option_strings"]
+        ]
+
+    def positionals(self, parser_id: int) -> list[int]:
+        actions = self.parser_actions[parser_id]
+        return [action_id for action_id in actions if not self.actions[action_id]["option_strings"]]
+
+    def values(self, action_id: int) -> tuple[str, list[str]]:
+        """
+        Returns how values of an action are completed: "words" (from the returned list), "files", "dirs", "none", or
+        "dynamic" (by running the program).
+        """
+        action = self.actions[action_id]
+        completer = action["completer"]
+        if action_id in self.subcommands:
+            return "words", [name for names, _, _ in self.subcommands[action_id] for name in names]
+        if action["nargs"] == 0:
+            return "none", []
+        if completer is None:
+            if action["choices"] is not None:
+                return "words", action["choices"]
+            return "files", []
+        if completer["kind"] == "choices":
+            return "words", completer["choices"]
+        if completer["kind"] == "suppress":
+            return "none", []
+        if completer["kind"] == "directories":
+            return "dirs", []
+        if completer["kind"] == "files" and not completer["allowednames"] and completer["directories"]:
+            return "files", []
+        return "dynamic", []
+
+    def nargs(self, action_id: int) -> str:
+        nargs = self.actions[action_id]["nargs"]
+        return "1" if nargs is None else str(nargs)
+
+
+def _bash_case(pattern: str, body: str) -> str:
+    return f"        {pattern}) {body} ;;"
+
+
+def _bash_static_shellcode(
+    spec: Mapping[str, Any], function: str, dynamic_function: str, complete_options: str, executables: str
+) -> str:
+    tables = _StaticTables(spec)
+    option_cases, positional_cases, subcommand_cases, options_cases, prefix_chars_cases = [], [], [], [], []
+    for parser_id, parser in enumerate(tables.parsers):
+        options = tables.options(parser_id)
+        for action_id in tables.parser_actions[parser_id]:
+            for option_string in tables.actions[action_id]["option_strings"]:
+                option_cases.append(_bash_case(quote(f"{parser_id} {option_string}"), f"REPLY={action_id}"))
+        for position, action_id in enumerate(tables.positionals(parser_id)):
+            positional_cases.append(_bash_case(quote(f"{parser_id} {position}"), f"REPLY={action_id}"))
+        if options:
+            flat_options = " ".join(f"{action_id} {quote(option_string)}" for action_id, option_string in options)
+            options_cases.append(_bash_case(str(parser_id), f"REPLY=({flat_options})"))
+        if parser["prefix_chars"] != "-":
+            prefix_chars_cases.append(_bash_case(str(parser_id), f"REPLY={quote(parser['prefix_chars'])}"))
+
+    nargs_cases, values_cases, conflicts_cases = [], [], []
+    for action_id in range(len(tables.actions)):
+        if tables.nargs(action_id) != "0":
+            nargs_cases.append(_bash_case(str(action_id), f"REPLY={quote(tables.nargs(action_id))}"))
+        kind, words = tables.values(action_id)
+        if kind == "words":
+            values_cases.append(_bash_case(str(action_id), f"kind=words REPLY=({' '.join(map(quote, words))})"))
+        elif kind != "none":
+            values_cases.append(_bash_case(str(action_id), f"kind={kind}"))
+        for names, _, child_id in tables.subcommands.get(action_id, []):
+            pattern = "|".join(quote(f"{action_id} {name}") for name in names)
+            subcommand_cases.append(_bash_case(pattern, f"REPLY={child_id}"))
+        if action_id in tables.conflicts:
+            conflicts = "".join(f"{conflict} " for conflict in sorted(tables.conflicts[action_id]))
+            conflicts_cases.append(_bash_case(str(action_id), f"REPLY={quote(conflicts)}"))
+
+    return bash_static_code % {
+        "function": function,
+        "dynamic_function": dynamic_function,
+        "complete_opts": complete_options,
+        "executables": executables,
+        "option_cases": "\n".join(option_cases),
+        "positional_cases": "\n".join(positional_cases),
+        "subcommand_cases": "\n".join(subcommand_cases),
+        "nargs_cases": "\n".join(nargs_cases),
+        "prefix_chars_cases": "\n".join(prefix_chars_cases),
+        "conflicts_cases": "\n".join(conflicts_cases),
+        "options_cases": "\n".join(options_cases),
+        "values_cases": "\n".join(values_cases),
+    }
+
+
+# Characters that are escaped in words of _arguments actions, which are split by the shell and end at a colon
+_zsh_special_chars = " \t\n\\'\"()[]{}<>|&;$`*?~#^!:"
+
+
+def _zsh_escape(text: str, special: str = _zsh_special_chars) -> str:
+    return re.sub(f"([{re.escape(special)}])", r"\\\1", text)
+
+
+class _ZshStaticSpecs:
+    """
+    Renders the parsers of a static completion spec as zsh ``_arguments`` specs.
+    """
+
+    repeatable_actions = {"append", "append_const", "count", "extend"}
+    exclusive_actions = {"help", "version"}
+
+    def __init__(self, tables: _StaticTables, function: str) -> None:
+        self.tables = tables
+        self.function = function
+        self.dynamic_action = f"{{{function}_dynamic}}"
+
+    def action(self, action_id: int) -> str:
+        kind, words = self.tables.values(action_id)
+        if kind == "words":
+            return f"({' '.join(map(_zsh_escape, words))})"
+        if kind == "files":
+            return "_files"
+        if kind == "dirs":
+            return "_files -/"
+        if kind == "dynamic":
+            return self.dynamic_action
+        return " "
+
+    def subcommands_action(self, action_id: int) -> str:
+        items: list[str] = []
+        for names, help, _ in self.tables.subcommands[action_id]:
+            description = _zsh_escape(" ".join(help.split())) if help else ""
+            items.extend(f"{_zsh_escape(name)}\\:{description}" for name in names)
+        return f"(({' '.join(items)}))"
+
+    def message(self, action_id: int, index: int = 0) -> str:
+        action = self.tables.actions[action_id]
+        metavar = action["metavar"]
+        if isinstance(metavar, list):
+            metavar = metavar[min(index, len(metavar) - 1)]
+        if metavar is None:
+            metavar = action["dest"].upper() if action["option_strings"] else action["dest"]
+        return _zsh_escape(metavar, "\\:")
+
+    def option_arguments(self, action_id: int) -> str:
+        nargs = self.tables.actions[action_id]["nargs"]
+        if nargs == 0:
+            return ""
+        if nargs == "?":
+            return f"::{self.message(action_id)}:{self.action(action_id)}"
+        if isinstance(nargs, int):
+            return "".join(f":{self.message(action_id, i)}:{self.action(action_id)}" for i in range(nargs))
+        if nargs in (None, "*", "+"):
+            # _arguments can't tell where a variable number of option arguments ends, so only the first is completed
+            return f":{self.message(action_id)}:{self.action(action_id)}"
+        return f":*:{self.message(action_id)}:{self.dynamic_action}"
+
+    def option_specs(self, parser_id: int) -> list[str]:
+        prefix_chars = self.tables.parsers[parser_id]["prefix_chars"]
+        specs = []
+        for action_id in self.tables.parser_actions[parser_id]:
+            action = self.tables.actions[action_id]
+            if not action["option_strings"] or action["suppressed"]:
+                continue
+            if action["action"] in self.exclusive_actions:
+                exclusions = "(- : *)"
+            else:
+                excluded = [] if action["action"] in self.repeatable_actions else list(action["option_strings"])
+                for conflict_id in sorted(self.tables.conflicts.get(action_id, ())):
+                    excluded.extend(self.tables.actions[conflict_id]["option_strings"])
+                exclusions = f"({' '.join(excluded)})" if excluded else ""
+            repeat = "*" if action["action"] in self.repeatable_actions else ""
+            help = _zsh_escape(" ".join(action["help"].split()), "\\[]") if action["help"] else ""
+            arguments = self.option_arguments(action_id)
+            for option_string in action["option_strings"]:
+                if not arguments:
+                    separator = ""
+                elif len(option_string) == 2 and option_string[1] not in prefix_chars:
+                    separator = "+"
+                else:
+                    separator = "="
+                description = f"[{help}]" if help else ""
+                specs.append(f"{exclusions}{repeat}{option_string}{separator}{description}{arguments}")
+        return specs
+
+    def positional_specs(self, parser_id: int) -> list[str]:
+        specs = []
+        for action_id in self.tables.positionals(parser_id):
+            nargs = self.tables.actions[action_id]["nargs"]
+            message, action = self.message(action_id), self.action(action_id)
+            if nargs is None:
+                specs.append(f":{message}:{action}")
+            elif nargs == "?":
+                specs.append(f"::{message}:{action}")
+            elif isinstance(nargs, int):
+                specs.extend(f":{self.message(action_id, i)}:{action}" for i in range(nargs))
+            elif nargs == "+":
+                specs.extend([f":{message}:{action}", f"*:{message}:{action}"])
+                break
+            elif nargs == "*":
+                specs.append(f"*:{message}:{action}")
+                break
+            elif nargs == argparse.PARSER:
+                message = message if self.tables.actions[action_id]["metavar"] else "command"
+                specs.extend([f":{message}:{self.subcommands_action(action_id)}", "*::arg:->subcommand"])
+                break
+            elif nargs == argparse.REMAINDER:
+                specs.append(f"*::{message}:{self.dynamic_action}")
+                break
+        return specs
+
+    def parser_function(self, parser_id: int) -> str:
+        if not set(self.tables.parsers[parser_id]["prefix_chars"]) <= set("-+"):
+            # _arguments only knows about options starting with "-" or "+"
+            return f"{self.function}_{parser_id}() {{\n    {self.function}_dynamic\n}}\n"
+        specs = self.option_specs(parser_id) + self.positional_specs(parser_id)
+        subcommand_cases = [
+            f"            ({'|'.join(quote(name) for name in names)}) {self.function}_{child_id} && ret=0 ;;"
+            for action_id in self.tables.parser_actions[parser_id]
+            for names, _, child_id in self.tables.subcommands.get(action_id, [])
+        ]
+        subcommand_dispatch = ""
+        if subcommand_cases:
+            subcommand_dispatch = zsh_static_subcommand_code % {
+                "function": self.function,
+                "subcommand_cases": "\n".join(subcommand_cases),
+            }
+        return zsh_static_parser_code % {
+            "function": self.function,
+            "parser_id": parser_id,
+            "specs": " \\\n".join(f"        {quote(spec)}" for spec in specs),
+            "subcommand_dispatch": subcommand_dispatch,
+        }
+
+
+def _zsh_static_shellcode(
+    spec: Mapping[str, Any], function: str, dynamic_function: str, executables: str, **bash_functions_args: str
+) -> str:
+    tables = _StaticTables(spec)
+    specs = _ZshStaticSpecs(tables, function)
+    return zsh_static_code % {
+        "function": function,
+        "dynamic_function": dynamic_function,
+        "executables": executables,
+        "parser_functions": "\n".join(specs.parser_function(parser_id) for parser_id in range(len(tables.parsers))),
+        **bash_functions_args,
+    }
+
+
+def _fish_quote(text: str) -> str:
+    if re.fullmatch(r"[\w./@+,=%:-]+", text):
+        return text
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _fish_words(words: list[str]) -> str:
+    # complete -a arguments are split and expanded like a command line
+    return _fish_quote(" ".join(re.sub(r"([^\w./@+,=%:-])", r"\\\1", word) for word in words))
+
+
+def _fish_option_flags(option_string: str) -> str | None:
+    if option_string[0] != "-" or len(option_string) < 2:
+        # complete only knows about options starting with "-"
+        return None
+    if option_string.startswith("--"):
+        return f"-l {_fish_quote(option_string[2:])}"
+    if len(option_string) == 2:
+        return f"-s {_fish_quote(option_string[1:])}"
+    return f"-o {_fish_quote(option_string[1:])}"
+
+
+def _fish_static_shellcode(spec: Mapping[str, Any], executable: str, completion_arg: str, function_name: str) -> str:
+    tables = _StaticTables(spec)
+    complete = f"complete {completion_arg} {executable}"
+    dynamic = _fish_quote(f"(__fish_{function_name}_complete)")
+
+    def values_flags(action_id: int) -> str:
+        kind, words = tables.values(action_id)
+        if kind == "words":
+            return f"-a {_fish_words(words)}"
+        if kind == "files":
+            return "-F"
+        if kind == "dirs":
+            return "-a '(__fish_complete_directories)'"
+        if kind == "dynamic":
+            return f"-a {dynamic}"
+        return ""
+
+    def help_flags(help: str | None) -> str:
+        return f" -d {_fish_quote(' '.join(help.split()))}" if help else ""
+
+    subcommand_cases, completions = [], []
+    for parser_id, parser in enumerate(tables.parsers):
+        condition = f"__fish_{function_name}_static_using_parser {parser_id}"
+        if not set(parser["prefix_chars"]) <= set("-"):
+            completions.append(f"{complete} -n {_fish_quote(condition)} -a {dynamic}")
+            continue
+        for action_id in tables.parser_actions[parser_id]:
+            action = tables.actions[action_id]
+            if action["option_strings"]:
+                if action["suppressed"]:
+                    continue
+                flags = [_fish_option_flags(option_string) for option_string in action["option_strings"]]
+                option_condition = condition
+                conflicts = [
+                    _fish_option_flags(option_string)
+                    for conflict_id in sorted(tables.conflicts.get(action_id, ()))
+                    for option_string in tables.actions[conflict_id]["option_strings"]
+                ]
+                if any(conflicts):
+                    option_condition += "; and not __fish_seen_argument " + " ".join(c for c in conflicts if c)
+                if action["nargs"] != 0:
+                    flags.extend(["-r", values_flags(action_id)])
+                completions.append(
+                    f"{complete} -n {_fish_quote(option_condition)} {' '.join(f for f in flags if f)}"
+                    + help_flags(action["help"])
+                )
+            elif action_id in tables.subcommands:
+                for names, help, child_id in tables.subcommands[action_id]:
+                    subcommand_cases.append(
+                        f"            case {' '.join(_fish_quote(f'{parser_id} {name}') for name in names)}\n"
+                        f"                set parser {child_id}"
+                    )
+                    for name in names:
+                        completions.append(
+                            f"{complete} -n {_fish_quote(condition)} -a {_fish_words([name])}" + help_flags(help)
+                        )
+            elif not action["suppressed"] and values_flags(action_id):
+                completions.append(f"{complete} -n {_fish_quote(condition)} {values_flags(action_id)}")
+
+    return fish_static_code % {
+        "function_name": function_name,
+        "completion_arg": completion_arg,
+        "executable": executable,
+        "subcommand_cases": "\n".join(subcommand_cases),
+        "completions": "\n".join(completions),
+    }
+
+
+def _static_function_name(executables: list[str]) -> str:
+    # Static tables are specific to one program, so they are named after it rather than after the shared shellcode.
+    return "_python_argcomplete_static_" + re.sub(r"\W", "_", executables[0] if executables else "")
+
+
 def shellcode(
     executables: Iterable[str],
     use_defaults: bool = True,
     shell: str = "bash",
     complete_arguments: Iterable[str] | None = None,
     argcomplete_script: str | None = None,
+    static: bool = False,
+    spec: Mapping[str, Any] | None = None,
 ) -> str:
     """
     Provide the shell code required to register a python executable for use with the argcomplete module.
@@ -157,8 +861,16 @@ def shellcode(
     :param argcomplete_script: Script to call complete with, if not the executable to complete.
         If supplied, will be used to complete *all* passed executables.
     :type argcomplete_script: str or None
+    :param bool static: Whether to compile **spec** into native shell completion code that only runs the Python program
+        for actions with custom completers (affects bash, zsh and fish only)
+    :param spec: Completion spec (see :meth:`argcomplete.CompletionFinder.export_spec`) to use for static completion
+    :type spec: dict or None
     """
 
+    if static and spec is None:
+        raise ValueError("Static shellcode requires a completion spec")
+    executables = list(executables)
+
     if complete_arguments is None:
         complete_options = "-o nospace -o default -o bashdefault" if use_defaults else "-o nospace -o bashdefault"
     else:
@@ -174,12 +886,31 @@ def shellcode(
         else:
             script = ""
             function_suffix = ""
+        if static and shell == "zsh":
+            assert spec is not None
+            return _zsh_static_shellcode(
+                spec,
+                function=_static_function_name(executables),
+                dynamic_function="_python_argcomplete" + function_suffix,
+                executables=executables_list,
+                argcomplete_script=script,
+                function_suffix=function_suffix,
+            )
         code = bashcode % {
             "complete_opts": complete_options,
             "executables": executables_list,
             "argcomplete_script": script,
             "function_suffix": function_suffix,
         }
+        if static:
+            assert spec is not None
+            code += _bash_static_shellcode(
+                spec,
+                function=_static_function_name(executables),
+                dynamic_function="_python_argcomplete" + function_suffix,
+                complete_options=complete_options,
+                executables=executables_list,
+            )
     elif shell == "fish":
         code = ""
         for executable in executables:
@@ -187,12 +918,15 @@ def shellcode(
             completion_arg = "--path" if "/" in executable else "--command"  # use path for absolute paths
             function_name = executable.replace("/", "_")  # / not allowed in function name
 
-            code += fishcode % {
+            code += (_fish_function_code if static else fishcode) % {
                 "executable": executable,
                 "argcomplete_script": script,
                 "completion_arg": completion_arg,
                 "function_name": function_name,
             }
+            if static:
+                assert spec is not None
+                code += _fish_static_shellcode(spec, executable, completion_arg, function_name)
     elif shell == "powershell":
         code = ""
         for executable in executables:
@@ -0,0 +1,90 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+# This file contains the rules for escaping completions for each of the supported shells.
+
+from __future__ import annotations
+
+import re
+from collections.abc import Callable
+
+# Characters escaped in a word that is not quoted, and in a word opened with a double quote
+_UNQUOTED_SPECIAL_CHARS = "\\();<>|&!`$*?[]{} \t\n\"'"
+_DOUBLE_QUOTED_SPECIAL_CHARS = '\\"`$!'
+
+
+class ShellDialect:
+    """
+    Describes how the shell called **name** expects completions to be escaped. Completions are escaped by prefixing
+    special characters with **escape_char**. **extra_special_chars** are escaped in addition to the characters that are
+    special in every shell. If **escapes_itself** is true, the shell escapes completions itself and they are output as
+    they are.
+    """
+
+    def __init__(
+        self, name: str, escape_char: str = "\\", extra_special_chars: str = "", escapes_itself: bool = False
+    ) -> None:
+        self.name = name
+        self.escape_char = escape_char
+        self.extra_special_chars = extra_special_chars
+        self.escapes_itself = escapes_itself
+        self._escapers: dict[str, Callable[[str], str]] = {}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.name!r})"
+
+    def escaper(self, cword_prequote: str) -> Callable[[str], str]:
+        """
+        Returns a function that escapes a completion in a single pass, for a word opened with **cword_prequote** (``""``,
+        ``"'"`` or ``'"'``).
+        """
+        escaper = self._escapers.get(cword_prequote)
+        if escaper is None:
+            escaper = self._escapers[cword_prequote] = self._make_escaper(cword_prequote)
+        return escaper
+
+    def _make_escaper(self, cword_prequote: str) -> Callable[[str], str]:
+        if self.escapes_itself:
+            return str
+        table: dict[int, str] = {}
+        if cword_prequote == "'":
+            # Nothing can be escaped in single quotes, so we need to close
+            # the string, escape the single quote, then open a new string.
+            table[ord("'")] = r"'\''"
+            special_chars = ""
+        elif cword_prequote == '"':
+            special_chars = _DOUBLE_QUOTED_SPECIAL_CHARS
+        else:
+            special_chars = _UNQUOTED_SPECIAL_CHARS
+        if self.escape_char != "\\":
+            # Only the backslash escapes itself
+            special_chars = special_chars.replace(self.escape_char, "")
+        for char in special_chars + self.extra_special_chars:
+            table[ord(char)] = self.escape_char + char
+        if not table:
+            return str
+        # Most completions contain no special characters; finding that out is cheaper than translating them
+        search = re.compile("[" + re.escape("".join(map(chr, table))) + "]").search
+
+        def escape(completion: str) -> str:
+            return completion.translate(table) if search(completion) else completion
+
+        return escape
+
+
+_DIALECTS = {
+    "bash": ShellDialect("bash"),
+    # zsh uses colon as a separator between a completion and its description.
+    "zsh": ShellDialect("zsh", extra_special_chars=":"),
+    "fish": ShellDialect("fish", escapes_itself=True),
+    "tcsh": ShellDialect("tcsh", escapes_itself=True),
+    # PowerShell uses ` as escape character.
+    "powershell": ShellDialect("powershell", escape_char="`"),
+}
+
+
+def get_dialect(shell: str | None) -> ShellDialect:
+    """
+    Returns the dialect of **shell** (a value of ``_ARGCOMPLETE_SHELL``), falling back to bash for unknown shells.
+    """
+    return _DIALECTS.get(shell or "bash", _DIALECTS["bash"])
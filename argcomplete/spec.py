@@ -0,0 +1,266 @@
+# Copyright 2012-2023, Andrey Kislyuk and argcomplete contributors.
+# Licensed under the Apache License. See https://github.com/kislyuk/argcomplete for more info.
+
+# This file contains utilities for exporting an argument parser tree as a static, JSON-serializable completion spec.
+
+from __future__ import annotations
+
+import argparse
+import functools
+import importlib
+import sys
+from collections.abc import Callable
+from typing import Any
+
+from .completers import ChoicesCompleter, DirectoriesCompleter, EnvironCompleter, FilesCompleter, SuppressCompleter
+
+SPEC_VERSION = 1
+
+
+def completer_reference(completer: object) -> str | None:
+    """
+    Returns an importable ``module:qualname`` reference for **completer**. Completers that are not module-level
+    functions or objects are referenced by their class. Returns ``None`` if no importable reference exists.
+    """
+    qualname = getattr(completer, "__qualname__", None)
+    module_name = getattr(completer, "__module__", None)
+    if qualname is None and module_name is not None:
+        # An instance: look for a module-level name bound to it, then fall back to its class.
+        for name, value in vars(sys.modules.get(module_name, object)).items():
+            if value is completer:
+                qualname = name
+                break
+        else:
+            qualname = type(completer).__qualname__
+    # Local functions and lambdas (qualnames such as "f.<locals>.g" and "<lambda>") can't be imported
+    if qualname is None or module_name is None or "<" in qualname or module_name == "__main__":
+        return None
+    return f"{module_name}:{qualname}"
+
+
+def resolve_reference(reference: str) -> Any:
+    """
+    Imports and returns the object referenced by a ``module:qualname`` string.
+    """
+    module_name, _, qualname = reference.partition(":")
+    target: Any = importlib.import_module(module_name)
+    for attr in qualname.split(".") if qualname else []:
+        target = getattr(target, attr)
+    return target
+
+
+def completer_spec(action: argparse.Action) -> dict[str, Any] | None:
+    completer = getattr(action, "completer", None)
+    if completer is None:
+        return None
+    spec: dict[str, Any] = {"kind": "custom", "ref": completer_reference(completer)}
+    if type(completer) is SuppressCompleter:
+        spec["kind"] = "suppress"
+    elif type(completer) is ChoicesCompleter and completer is not EnvironCompleter:
+        spec["kind"] = "choices"
+        spec["choices"] = [completer._convert(c) for c in completer.choices]
+        spec["ignore_case"] = completer.ignore_case
+    elif type(completer) is DirectoriesCompleter:
+        spec["kind"] = "directories"
+    elif type(completer) is FilesCompleter:
+        spec["kind"] = "files"
+        spec["allowednames"] = list(completer.allowednames)
+        spec["directories"] = completer.directories
+        spec["compgen"] = completer.compgen
+    return spec
+
+
+def _action_names(parser: argparse.ArgumentParser) -> dict[type, str]:
+    names: dict[type, str] = {}
+    for name, action_class in parser._registries.get("action", {}).items():
+        if name is not None:
+            names.setdefault(action_class, name)
+    return names
+
+
+def action_spec(
+    action: argparse.Action,
+    get_action_help: Callable[[argparse.Action], str],
+    action_names: dict[type, str],
+) -> dict[str, Any]:
+    action_class = getattr(action, "_orig_class", type(action))
+    completer = getattr(action, "completer", None)
+    suppressed = action.help == argparse.SUPPRESS
+    if isinstance(completer, SuppressCompleter) and completer.suppress():
+        suppressed = True
+    metavar: Any = action.metavar
+    if isinstance(metavar, tuple):
+        metavar = list(metavar)
+
+    spec: dict[str, Any] = {
+        "dest": action.dest,
+        "option_strings": list(action.option_strings),
+        "action": action_names.get(action_class),
+        "class": f"{action_class.__module__}:{action_class.__qualname__}",
+        "nargs": action.nargs,
+        "choices": None,
+        "metavar": metavar,
+        "help": None if action.help is None or action.help == argparse.SUPPRESS else get_action_help(action),
+        "required": bool(action.required),
+        "suppressed": suppressed,
+        "completer": completer_spec(action),
+    }
+
+    if isinstance(action, argparse._SubParsersAction):
+        spec["subcommands"] = subcommands_spec(action, get_action_help)
+    elif action.choices is not None:
+        spec["choices"] = [c if isinstance(c, str) else str(c) for c in action.choices]
+    return spec
+
+
+def subcommands_spec(
+    action: argparse._SubParsersAction, get_action_help: Callable[[argparse.Action], str]
+) -> list[dict[str, Any]]:
+    # Group aliases by the parser they map to, in the order they were added
+    names_by_parser: dict[int, list[str]] = {}
+    for name, subparser in dict.items(action._name_parser_map):
+        names_by_parser.setdefault(id(subparser), []).append(name)
+
+    help_by_name = {}
+    for choice_action in action._get_subactions():
+        help_by_name[choice_action.dest] = get_action_help(choice_action) if choice_action.help is not None else None
+
+    subcommands = []
+    for name, *aliases in names_by_parser.values():
+        subcommands.append(
+            {
+                "name": name,
+                "aliases": aliases,
+                "help": help_by_name.get(name),
+                "parser": parser_spec(action._name_parser_map[name], get_action_help),
+            }
+        )
+    return subcommands
+
+
+def parser_spec(
+    parser: argparse.ArgumentParser, get_action_help: Callable[[argparse.Action], str] | None = None
+) -> dict[str, Any]:
+    """
+    Walks **parser** and its subparsers and returns a JSON-serializable description of their actions.
+
+    :param get_action_help:
+        Function used to render the help string of an action. Defaults to expanding it with the parser's formatter.
+    """
+    if get_action_help is None:
+
+        def get_action_help(action):
+            if "%" not in action.help:
+                return action.help
+            return parser._get_formatter()._expand_help(action)
+
+    action_names = _action_names(parser)
+    index_by_action = {id(action): i for i, action in enumerate(parser._actions)}
+    return {
+        "prog": parser.prog,
+        "prefix_chars": parser.prefix_chars,
+        "allow_abbrev": parser.allow_abbrev,
+        "actions": [action_spec(action, get_action_help, action_names) for action in parser._actions],
+        "mutually_exclusive_groups": [
+            {"required": group.required, "actions": [index_by_action[id(action)] for action in group._group_actions]}
+            for group in parser._mutually_exclusive_groups
+        ],
+    }
+
+
+class _SpecAction(argparse.Action):
+    """
+    Stands in for custom action classes when rebuilding a parser from a spec. Like custom actions, it is never
+    executed during completion.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        pass
+
+
+@functools.cache
+def _action_parameters(action_class: type) -> frozenset[str]:
+    import inspect
+
+    return frozenset(inspect.signature(action_class).parameters)
+
+
+def _build_completer(spec: dict[str, Any] | None, custom_completer: Callable[[dict[str, Any]], Any]) -> Any:
+    if spec is None:
+        return None
+    kind = spec["kind"]
+    if kind == "suppress":
+        return SuppressCompleter()
+    if kind == "choices":
+        return ChoicesCompleter(spec["choices"], ignore_case=spec.get("ignore_case", False))
+    if kind == "directories":
+        return DirectoriesCompleter()
+    if kind == "files":
+        return FilesCompleter(spec["allowednames"], directories=spec["directories"], compgen=spec.get("compgen", False))
+    return custom_completer(spec)
+
+
+def _escape_help(help: str | None) -> str | None:
+    # Help strings are stored expanded, and would otherwise be expanded again by the rebuilt parser
+    return None if help is None else help.replace("%", "%%")
+
+
+def build_parser(
+    spec: dict[str, Any],
+    custom_completer: Callable[[dict[str, Any]], Any],
+    parser_class: type = argparse.ArgumentParser,
+) -> argparse.ArgumentParser:
+    """
+    Rebuilds an argument parser tree from a parser spec produced by :func:`parser_spec`. The result is only suitable for
+    completion: completers are restored for the built-in completer types, and **custom_completer** is called with the
+    completer spec of every action that has a custom completer to get a stand-in for it.
+    """
+    parser = parser_class(
+        prog=spec["prog"], prefix_chars=spec["prefix_chars"], allow_abbrev=spec["allow_abbrev"], add_help=False
+    )
+    registry = parser._registries["action"]
+    actions = []
+    for action_spec in spec["actions"]:
+        kwargs = {
+            "option_strings": action_spec["option_strings"],
+            "dest": action_spec["dest"],
+            "nargs": action_spec["nargs"],
+            "const": None,
+            "choices": action_spec["choices"],
+            "required": action_spec["required"],
+            "help": argparse.SUPPRESS if action_spec["suppressed"] else _escape_help(action_spec["help"]),
+            "metavar": action_spec["metavar"],
+        }
+        action: argparse.Action
+        if "subcommands" in action_spec:
+            del kwargs["choices"], kwargs["nargs"], kwargs["const"]
+            kwargs["prog"] = spec["prog"]
+            kwargs["parser_class"] = parser_class
+            action = argparse._SubParsersAction(**kwargs)
+            for subcommand in action_spec["subcommands"]:
+                subparser = build_parser(subcommand["parser"], custom_completer, parser_class=parser_class)
+                for name in [subcommand["name"], *subcommand["aliases"]]:
+                    action._name_parser_map[name] = subparser
+                if subcommand["help"] is not None:
+                    choice_action = action._ChoicesPseudoAction(
+                        subcommand["name"], subcommand["aliases"], _escape_help(subcommand["help"])
+                    )
+                    action._choices_actions.append(choice_action)
+        else:
+            # Custom actions, including those the program registered under a name, are stood in for
+            name = action_spec["action"]
+            action_class = _SpecAction if name is None else registry.get(name, _SpecAction)
+            if action_class is not _SpecAction:
+                accepted = _action_parameters(action_class)
+                kwargs = {key: value for key, value in kwargs.items() if key in accepted}
+            action = action_class(**kwargs)
+        completer = _build_completer(action_spec["completer"], custom_completer)
+        if completer is not None:
+            action.completer = completer  # type: ignore[union-attr]
+        parser._add_action(action)
+        actions.append(action)
+
+    for group_spec in spec["mutually_exclusive_groups"]:
+        group = parser.add_mutually_exclusive_group(required=group_spec["required"])
+        group._group_actions.extend(actions[i] for i in group_spec["actions"])
+    return parser
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Benchmarks for completing with large parsers and large numbers of candidates. Run with ``python test/bench.py``.
+
+For each number of candidates, prints the time taken to filter them (de-duplicating and applying ``exclude``), and the
+time taken to filter, quote and write them as the shell code would receive them. Both should grow linearly.
+
+For each number of options in a synthetic parser, prints the time taken by the first
+completion, which patches the parser, and by later completions with the same parser.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from argcomplete import CompletionFinder
+from argcomplete.finders import _write_completions
+from argcomplete.io import mute_stdout
+
+IFS = "\013"
+
+
+def make_candidates(count):
+    # One candidate in ten is a duplicate, as when several completers return overlapping results
+    return [f"candidate-{i - i % 10 if i % 10 == 9 else i}" for i in range(count)]
+
+
+def best_of(repeat, function, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_parser(options):
+    parser = argparse.ArgumentParser(prog="prog")
+    for i in range(options):
+        # Half of the options are in mutually exclusive groups of 200, as generated from enums
+        if i % 400 == 200:
+            container = parser.add_mutually_exclusive_group()
+        elif i % 400 == 0:
+            container = parser
+        container.add_argument(f"--option-{i}", type=int, help="option %(default)s")
+    return parser
+
+
+def complete(finder, parser, line):
+    os.environ.update(COMP_LINE=line, COMP_POINT=str(len(line)))
+    with mute_stdout():
+        finder(parser, output_stream=io.StringIO(), exit_method=lambda code: None)
+
+
+def bench_parser(args):
+    os.environ.update(_ARGCOMPLETE="1", _ARGCOMPLETE_IFS=IFS, _ARGCOMPLETE_SHELL="bash")
+    line = "prog --option-0 1 --option-250 2 --option-9"
+    print(f"{'options':>10} {'first':>12} {'later':>12}")
+    count = 10
+    while count <= args.max_options:
+        timings = []
+        for _ in range(args.repeat):
+            parser = make_parser(count)
+            start = time.perf_counter()
+            complete(CompletionFinder(), parser, line)
+            timings.append(time.perf_counter() - start)
+        later_time = best_of(args.repeat, complete, CompletionFinder(), parser, line)
+        print(f"{count:>10} {min(timings) * 1000:>10.2f}ms {later_time * 1000:>10.2f}ms")
+        count *= 10
+    for name in ("_ARGCOMPLETE", "_ARGCOMPLETE_IFS", "COMP_LINE", "COMP_POINT"):
+        del os.environ[name]
+
+
+def bench_output(args):
+    os.environ["_ARGCOMPLETE_SHELL"] = "bash"
+    finder = CompletionFinder(exclude=[f"candidate-{i}" for i in range(0, 1000, 7)], append_space=True)
+
+    def pipeline(candidates):
+        completions = finder._iter_quoted(finder._iter_filtered(candidates), "", None)
+        _write_completions(io.StringIO(), completions, IFS)
+
+    print(f"{'candidates':>10} {'filter':>12} {'per item':>10} {'pipeline':>12} {'per item':>10}")
+    count = 10
+    while count <= args.max_count:
+        candidates = make_candidates(count)
+        filter_time = best_of(args.repeat, finder.filter_completions, candidates)
+        pipeline_time = best_of(args.repeat, pipeline, candidates)
+        print(
+            f"{count:>10} {filter_time * 1000:>10.2f}ms {filter_time / count * 1e9:>8.0f}ns"
+            f" {pipeline_time * 1000:>10.2f}ms {pipeline_time / count * 1e9:>8.0f}ns"
+        )
+        count *= 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-count", type=int, default=1000000, help="largest number of candidates to benchmark")
+    parser.add_argument("--max-options", type=int, default=10000, help="largest number of options to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs to take the best time of")
+    args = parser.parse_args()
+
+    bench_output(args)
+    print()
+    bench_parser(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,21 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import contextlib
+import glob
+import itertools
+import json
 import os
 import os.path
 import re
+import runpy
 import shutil
+import socket
 import subprocess
 import sys
+import threading
+import time
 import unittest
 import unittest.util
 from io import StringIO
@@ -24,8 +32,12 @@ sys.path.insert(0, BASE_DIR)
 from argparse import SUPPRESS, ArgumentParser
 
 import argcomplete
+import argcomplete.cache
+import argcomplete.daemon
 import argcomplete.io
+import argcomplete.spec
 from argcomplete import (
+    CachedCompleter,
     CompletionFinder,
     ExclusiveCompletionFinder,
     _check_module,
@@ -33,7 +45,7 @@ from argcomplete import (
     shellcode,
     warn,
 )
-from argcomplete.completers import DirectoriesCompleter, FilesCompleter, SuppressCompleter
+from argcomplete.completers import ChoicesCompleter, DirectoriesCompleter, FilesCompleter, SuppressCompleter
 from argcomplete.lexers import split_line
 
 # Default max length is insufficient for troubleshooting.
@@ -198,6 +210,60 @@ class TestArgcomplete(unittest.TestCase):
         for cmd, output in expected_outputs:
             self.assertEqual(set(self.run_completer(make_parser(), cmd)), set(output))
 
+    def test_choices_prefix_index(self):
+        hosts = [f"host-{i}" for i in range(10000, 0, -1)] + ["Host-A", "HOST-b", "ħost"]
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--host", choices=hosts)
+        parser.add_argument("--any-host").completer = ChoicesCompleter(hosts, ignore_case=True)
+        self.assertEqual(
+            self.run_completer(parser, "prog --host host-999"),
+            [f"host-{i}" for i in range(9999, 9989, -1)] + ["host-999"],
+        )
+        self.assertEqual(self.run_completer(parser, "prog --host H"), ["Host-A", "HOST-b"])
+        self.assertEqual(self.run_completer(parser, "prog --any-host HOST-"), hosts[:-1])
+        self.assertEqual(self.run_completer(parser, "prog --any-host host-b"), ["HOST-b "])
+        self.assertEqual(self.run_completer(parser, "prog --any-host ĦOST"), ["ħost "])
+
+        # Other validators see all choices
+        completions = self.run_completer(parser, "prog --host 9998", validator=lambda c, p: p in c)
+        self.assertEqual(completions, ["host-9998 "])
+
+        # The index is rebuilt when choices are added
+        hosts.append("host-0")
+        self.assertEqual(self.run_completer(parser, "prog --host host-0"), ["host-0 "])
+        # ... and when choices are replaced
+        hosts[-1] = "host-00"
+        self.assertEqual(self.run_completer(parser, "prog --host host-0"), ["host-00 "])
+
+        # Iterables without a length are searched on each completion
+        class Hosts:
+            def __iter__(self):
+                return iter(hosts)
+
+        parser.add_argument("--iter-host").completer = ChoicesCompleter(Hosts())
+        for _ in range(2):
+            self.assertEqual(self.run_completer(parser, "prog --iter-host host-0"), ["host-00 "])
+        parser.add_argument("--gen-host").completer = ChoicesCompleter(h for h in hosts if h.startswith("H"))
+        self.assertEqual(self.run_completer(parser, "prog --gen-host Host"), ["Host-A "])
+
+        # Mappings can change without changing size, and are searched on each completion
+        parser.add_argument("--env").completer = argcomplete.completers.EnvironCompleter
+        environ = argcomplete.completers.EnvironCompleter.choices
+        try:
+            environ["ZZ_OLD"] = "1"
+            self.assertEqual(self.run_completer(parser, "prog --env ZZ_"), ["ZZ_OLD "])
+            environ["ZZ_NEW"] = environ.pop("ZZ_OLD")
+            self.assertEqual(self.run_completer(parser, "prog --env ZZ_"), ["ZZ_NEW "])
+        finally:
+            environ.pop("ZZ_OLD", None)
+            environ.pop("ZZ_NEW", None)
+        regions = {"eu-west": "Ireland"}
+        parser.add_argument("--region").completer = ChoicesCompleter(regions.keys(), ignore_case=True)
+        self.assertEqual(self.run_completer(parser, "prog --region EU"), ["eu-west "])
+        regions.clear()
+        regions["eu-north"] = "Stockholm"
+        self.assertEqual(self.run_completer(parser, "prog --region EU"), ["eu-north "])
+
     def test_suppress_args(self):
         def make_parser():
             parser = ArgumentParser()
@@ -367,6 +433,45 @@ class TestArgcomplete(unittest.TestCase):
             self.assertEqual(FilesCompleter()(prefix), [])
             self.assertFalse(os.path.exists(marker))
 
+    def test_file_completion_matches_compgen(self):
+        with TempDir(prefix="test_dir_fc_compgen", dir="."):
+            os.makedirs(os.path.join("abc", "sub"))
+            os.makedirs(os.path.join("abc", ".hidden_dir"))
+            os.makedirs("dir.py")
+            for name in ("a.py", "b.txt", ".hidden.py", "with space", os.path.join("abc", "x.py")):
+                with open(name, "w") as fh:
+                    fh.write("test")
+            os.symlink("abc", "link")
+            os.symlink("nowhere", "broken")
+            prefixes = ["", ".", "..", "a", "abc", "abc/", "abc/.", "abc//", "l", "link/", "b", "w", "~", "~/", "x/"]
+            for args in [(), (["py"],), (["py", "txt"],), ((), False), (["py"], False)]:
+                for prefix in prefixes:
+                    with self.subTest(args=args, prefix=prefix):
+                        self.assertEqual(
+                            sorted(FilesCompleter(*args)(prefix)), sorted(FilesCompleter(*args, compgen=True)(prefix))
+                        )
+            self.assertEqual(FilesCompleter()("l"), ["link/"])
+            self.assertEqual(FilesCompleter()("b"), ["b.txt", "broken"])
+            self.assertEqual(FilesCompleter(["py"])("."), ["./", "../", ".hidden.py"])
+
+            # Variables are expanded to look up files, and kept in the completions. compgen runs with the process
+            # environment rather than the copy made by setUp, so the variable is set in both.
+            os.environ["ARC_TEST_DIR"] = self._os_environ["ARC_TEST_DIR"] = os.path.abspath("abc")
+            try:
+                for prefix in ["$ARC_TEST_DIR/", "${ARC_TEST_DIR}/", "$ARC_TEST_DIR/s", "$ARC_TEST_UNSET/a"]:
+                    for args in [(), (["py"],)]:
+                        with self.subTest(args=args, prefix=prefix):
+                            self.assertEqual(
+                                sorted(FilesCompleter(*args)(prefix)),
+                                sorted(FilesCompleter(*args, compgen=True)(prefix)),
+                            )
+                self.assertEqual(
+                    FilesCompleter()("$ARC_TEST_DIR/"),
+                    ["$ARC_TEST_DIR/x.py", "$ARC_TEST_DIR/.hidden_dir/", "$ARC_TEST_DIR/sub/"],
+                )
+            finally:
+                del self._os_environ["ARC_TEST_DIR"]
+
     def test_filescompleter_filetype_integration(self):
         def make_parser():
             parser = ArgumentParser()
@@ -651,6 +756,87 @@ class TestArgcomplete(unittest.TestCase):
         disp = completer.get_display_completions()
         self.assertEqual({"c": "abc help"}, disp)
 
+    def test_many_subcommands(self):
+        parser = ArgumentParser(add_help=False)
+        sub = parser.add_subparsers()
+        for i in range(2000, 0, -1):
+            sub.add_parser(f"cmd{i}", aliases=[f"alias{i}"], help=f"help {i}")
+        for prefix in "cmd199", "alias7":
+            expected = [f"{prefix.rstrip('0123456789')}{i}" for i in range(2000, 0, -1)]
+            expected = [name for name in expected if name.startswith(prefix)]
+            self.assertEqual(self.run_completer(parser, f"prog {prefix}"), expected)
+
+        # Subcommands added later are found too
+        sub.add_parser("cmd1999x")
+        self.assertEqual(self.run_completer(parser, "prog cmd1999"), ["cmd1999", "cmd1999x"])
+        finder = CompletionFinder(parser)
+        finder.rl_complete("alias1999", 0)
+        self.assertEqual(finder.get_display_completions(), {"alias1999": "help 1999"})
+
+    def test_many_options(self):
+        parser = ArgumentParser(add_help=False)
+        group = parser.add_mutually_exclusive_group()
+        for i in range(2000, 0, -1):
+            (group if i % 2 else parser).add_argument(f"--field-{i}", f"--f{i}", help=SUPPRESS if i == 1998 else None)
+        expected = [f"--field-{i}" for i in range(1999, 1989, -1) if i != 1998] + ["--field-199"]
+        self.assertEqual(self.run_completer(parser, "prog --field-199"), expected)
+        # Options in a mutually exclusive group with a given option are left out
+        expected = [f"--field-{i}" for i in range(1996, 1989, -2)]
+        self.assertEqual(self.run_completer(parser, "prog --field-1 1 --field-199"), expected)
+
+        # Options added later are found too
+        parser.add_argument("--field-1999x")
+        self.assertEqual(self.run_completer(parser, "prog --field-1999"), ["--field-1999", "--field-1999x"])
+
+    def test_parse_tables(self):
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--verbose", action="store_true")
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--json", action="store_true")
+        group.add_argument("--yaml", action="store_true")
+        self.assertEqual(self.run_completer(parser, "prog --verb --"), ["--verbose", "--json", "--yaml"])
+        self.assertEqual(self.run_completer(parser, "prog --json --"), ["--verbose", "--json"])
+        tables = parser._argcomplete_parse_tables
+        self.assertEqual(self.run_completer(parser, "prog --verbose --yaml --"), ["--verbose", "--yaml"])
+        self.assertIs(parser._argcomplete_parse_tables, tables)
+
+        # Tables are rebuilt when arguments or groups are added
+        group.add_argument("--toml", action="store_true")
+        self.assertEqual(self.run_completer(parser, "prog --toml --"), ["--verbose", "--toml"])
+        self.assertEqual(self.run_completer(parser, "prog --ver --"), ["--verbose", "--json", "--yaml", "--toml"])
+        other_group = parser.add_mutually_exclusive_group()
+        other_group._group_actions.append(parser._actions[0])
+        self.assertEqual(self.run_completer(parser, "prog --verbose --"), ["--verbose", "--json", "--yaml", "--toml"])
+        self.assertIsNot(parser._argcomplete_parse_tables, tables)
+
+    def test_lazy_help(self):
+        expanded = []
+
+        class RecordingFormatter(argparse.HelpFormatter):
+            def _expand_help(self, action):
+                expanded.append(action.dest)
+                return super()._expand_help(action)
+
+        parser = ArgumentParser(formatter_class=RecordingFormatter, add_help=False)
+        parser.add_argument("--apple", default=1, help="apples (default: %(default)s)")
+        parser.add_argument("--apricot", default=2, help="apricots (default: %(default)s)")
+        parser.add_argument("--avocado", help="avocados")
+        parser.add_argument("--fruit", choices=["kiwi", "kumquat"], help="one of %(choices)s")
+        self.assertEqual(set(self.run_completer(parser, "prog --a")), {"--apple", "--apricot", "--avocado"})
+        self.assertEqual(self.run_completer(parser, "prog --fruit k"), ["kiwi", "kumquat"])
+        self.assertEqual(expanded, [])
+
+        completions = self.run_completer(parser, "prog --a", shell="zsh", exclude=["--apricot"])
+        self.assertEqual(completions, ["--apple:apples (default: 1)", "--avocado:avocados"])
+        self.assertEqual(expanded, ["apple"])
+        expanded.clear()
+        os.environ["_ARGCOMPLETE_DFS"] = "\t"
+        self.assertEqual(
+            self.run_completer(parser, "prog --fruit k", shell="fish"),
+            ["kiwi\tone of kiwi, kumquat", "kumquat\tone of kiwi, kumquat"],
+        )
+        self.assertEqual(expanded, ["fruit"])
+
     def test_nargs_one_or_more(self):
         def make_parser():
             parser = ArgumentParser()
@@ -763,6 +949,258 @@ class TestArgcomplete(unittest.TestCase):
         for cmd, output in expected_outputs:
             self.assertEqual(set(self.run_completer(make_parser(), cmd)), set(output))
 
+    def test_concurrent_completers(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def make_completer(*completions):
+            def completer(**kwargs):
+                # Only returns if the other completer is running at the same time
+                barrier.wait()
+                yield from completions
+
+            return completer
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("first", nargs="*").completer = make_completer("b1", "b2")
+        parser.add_argument("second").completer = make_completer("a1", "a2")
+        self.assertEqual(self.run_completer(parser, "prog ", completer_threads=2), ["b1", "b2", "a1", "a2"])
+
+    def test_async_completers(self):
+        class AsyncCompleter:
+            def __init__(self, wait_for, done, completions):
+                self.wait_for, self.done, self.completions = wait_for, done, completions
+
+            async def __call__(self, **kwargs):
+                self.done.set()
+                await asyncio.wait_for(self.wait_for.wait(), 5)
+                return self.completions
+
+        first_done, second_done = asyncio.Event(), asyncio.Event()
+
+        async def third_completer(**kwargs):
+            yield "c1"
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("first", nargs="*").completer = AsyncCompleter(second_done, first_done, ["b1"])
+        parser.add_argument("second", nargs="*").completer = AsyncCompleter(first_done, second_done, {"a1": "A1"})
+        parser.add_argument("third").completer = third_completer
+        self.assertEqual(self.run_completer(parser, "prog "), ["b1", "a1", "c1"])
+        self.assertEqual(self.run_completer(parser, "prog ", shell="zsh"), ["b1:", "a1:A1", "c1:"])
+
+    def test_import_is_light(self):
+        # Programs import argcomplete on every run, so modules only needed by some completions are imported on demand
+        code = "import sys, argcomplete; print(' '.join(m for m in sys.argv[1:] if m in sys.modules))"
+        output = subprocess.check_output(
+            [sys.executable, "-c", code, "asyncio", "hashlib", "inspect", "json", "tempfile"], cwd=BASE_DIR
+        )
+        self.assertEqual(output.decode().split(), [])
+
+    def test_max_completions(self):
+        def endless_completer(**kwargs):
+            for i in itertools.count():
+                yield f"item{i}"
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--endless").completer = endless_completer
+        parser.add_argument("--size", choices=["small", "medium", "large"])
+
+        finder = CompletionFinder()
+        completions = self.run_completer(parser, "prog --endless i", completer=finder, max_completions=3)
+        self.assertEqual(completions, ["item0", "item1", "item2"])
+        self.assertTrue(finder.truncated)
+        completions = self.run_completer(parser, "prog --size ", completer=finder, max_completions=3)
+        self.assertEqual(completions, ["small", "medium", "large"])
+        self.assertFalse(finder.truncated)
+
+        os.environ["_ARC_MAX_COMPLETIONS"] = "2"
+        self.assertEqual(self.run_completer(parser, "prog --size "), ["small", "medium"])
+        self.assertEqual(self.run_completer(parser, "prog --size ", max_completions=1), ["small "])
+
+        # Truncation is shown by zsh and fish
+        os.environ["_ARGCOMPLETE_MESSAGES"] = "1"
+        self.assertEqual(
+            self.run_completer(parser, "prog --size ", shell="zsh"),
+            ["small:", "medium:", "\x1eshowing the first 2 completions"],
+        )
+        os.environ["_ARGCOMPLETE_DFS"] = "\t"
+        self.assertEqual(
+            self.run_completer(parser, "prog --size ", shell="fish"),
+            ["small\t", "medium\t(showing the first 2 completions)"],
+        )
+
+    def test_max_completions_async(self):
+        closed = []
+
+        async def endless_completer(**kwargs):
+            try:
+                for i in itertools.count():
+                    yield f"item{i}"
+            finally:
+                closed.append(True)
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--endless").completer = endless_completer
+
+        finder = CompletionFinder()
+        completions = self.run_completer(parser, "prog --endless i", completer=finder, max_completions=3)
+        self.assertEqual(completions, ["item0", "item1", "item2"])
+        self.assertTrue(finder.truncated)
+        self.assertEqual(closed, [True])
+
+    def test_filter_completions(self):
+        completions = ["b", "a", "c", "a", "b", "d"]
+        self.assertEqual(CompletionFinder().filter_completions(completions), ["b", "a", "c", "d"])
+        for exclude in ["c", "d"], ("c", "d"), {"c", "d"}, (x for x in "cd"):
+            finder = CompletionFinder(exclude=exclude)
+            self.assertEqual(finder.filter_completions(iter(completions)), ["b", "a"])
+
+    def test_parser_patched_once(self):
+        parser = ArgumentParser(add_help=False)
+        sub = parser.add_subparsers().add_parser("sub", add_help=False)
+        sub.add_argument("--alpha")
+        parser.add_argument("--beta")
+        self.assertEqual(self.run_completer(parser, "prog sub --"), ["--alpha "])
+        action_classes = [type(action) for action in parser._actions + sub._actions]
+        self.assertIs(type(parser._actions[1]), type(sub._actions[0]))
+
+        # Another finder completes with the same parser, including actions added since it was patched
+        sub.add_argument("--gamma", action="store_true")
+        self.assertEqual(
+            self.run_completer(parser, "prog sub --", completer=CompletionFinder()), ["--alpha", "--gamma"]
+        )
+        self.assertEqual(self.run_completer(parser, "prog sub --gamma --al"), ["--alpha "])
+        self.assertEqual([type(action) for action in parser._actions + sub._actions[:-1]], action_classes)
+
+        # Outside of completion, the patched actions behave as the original ones
+        self.assertEqual(parser.parse_args(["--beta", "1", "sub", "--gamma"]).gamma, True)
+
+    def test_streamed_output(self):
+        class RecordingStream(StringIO):
+            def __init__(self):
+                super().__init__()
+                self.write_sizes = []
+
+            def write(self, s):
+                self.write_sizes.append(len(s))
+                return super().write(s)
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--item").completer = lambda **kwargs: (f"item {i:06}" for i in range(12000))
+        os.environ["COMP_LINE"] = "prog --item "
+        os.environ["COMP_POINT"] = str(len(os.environ["COMP_LINE"]))
+        stream = RecordingStream()
+        with self.assertRaises(SystemExit):
+            CompletionFinder()(parser, output_stream=stream, exit_method=sys.exit)
+        self.assertEqual(stream.getvalue().split(IFS), [f"item\\ {i:06}" for i in range(12000)])
+        self.assertGreater(len(stream.write_sizes), 2)
+        self.assertLess(max(stream.write_sizes), 70000)
+
+        class UppercaseFinder(CompletionFinder):
+            def quote_completions(self, completions, cword_prequote, last_wordbreak_pos):
+                return [c.upper() for c in super().quote_completions(completions, cword_prequote, last_wordbreak_pos)]
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--size", choices=["small", "medium"])
+        self.assertEqual(self.run_completer(parser, "prog --size ", completer=UppercaseFinder()), ["SMALL", "MEDIUM"])
+        self.assertEqual(self.run_completer(parser, "prog --size m", completer=UppercaseFinder()), ["MEDIUM "])
+
+    def test_convert_values(self):
+        converted = []
+
+        def lookup(value):
+            converted.append(value)
+            return value.upper()
+
+        def completer(parsed_args, **kwargs):
+            return [f"{parsed_args.user}-{parsed_args.size}"]
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("--user", type=lookup)
+        parser.add_argument("--size", choices=["small", "large"])
+        parser.add_argument("--log", type=argparse.FileType("r"))
+        parser.add_argument("target").completer = completer
+
+        cmd = "prog --user bob --size huge --log /nonexistent/log "
+        # The parse stops at the invalid choice, before reaching the positional
+        self.assertEqual(self.run_completer(parser, cmd, always_complete_options=False), [""])
+        self.assertEqual(converted, ["bob"])
+        completions = self.run_completer(parser, "prog --user bob --size small ", always_complete_options=False)
+        self.assertEqual(completions, ["BOB-small "])
+
+        converted.clear()
+        completions = self.run_completer(parser, cmd, always_complete_options=False, convert_values=False)
+        self.assertEqual(completions, ["bob-huge "])
+        self.assertEqual(converted, [])
+
+        # Unknown subcommands still end the parse
+        parser = ArgumentParser(add_help=False)
+        parser.add_subparsers().add_parser("sub").add_argument("--opt")
+        self.assertEqual(self.run_completer(parser, "prog sub --", convert_values=False), ["--help", "--opt"])
+        self.assertEqual(self.run_completer(parser, "prog other --", convert_values=False), [""])
+
+    def test_parse_errors_skip_usage(self):
+        class RecordingParser(ArgumentParser):
+            usages = 0
+
+            def format_usage(self):
+                RecordingParser.usages += 1
+                return super().format_usage()
+
+        parser = RecordingParser(add_help=False)
+        parser.add_argument("--count", type=int)
+        parser.add_argument("name", choices=["alpha", "beta"])
+        parser.add_argument("--verbose", action="store_true")
+        self.assertEqual(self.run_completer(parser, "prog --count x --v"), ["--verbose "])
+        self.assertEqual(self.run_completer(parser, "prog --count 1 --v"), ["--verbose "])
+        self.assertEqual(RecordingParser.usages, 0)
+
+        with self.assertRaises(SystemExit), argcomplete.mute_stderr():
+            parser.parse_args(["--count", "x"])
+        self.assertEqual(RecordingParser.usages, 1)
+
+    def test_completion_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_generator(**kwargs):
+            yield "b1"
+            yield "b2"
+            release.wait(10)
+            yield "b3"
+
+        def blocking_completer(**kwargs):
+            release.wait(10)
+            return ["c1"]
+
+        async def slow_async_generator(**kwargs):
+            yield "d1"
+            await asyncio.sleep(10)
+            yield "d2"
+
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("first", nargs="*").completer = ChoicesCompleter(["a1"])
+        parser.add_argument("second", nargs="*").completer = slow_generator
+        parser.add_argument("third", nargs="*").completer = blocking_completer
+        parser.add_argument("fourth").completer = slow_async_generator
+        # Completers that didn't start before the deadline are abandoned too
+        for completer_threads, expected in (1, ["a1", "b1", "b2"]), (4, ["a1", "b1", "b2", "d1"]):
+            finder = CompletionFinder()
+            start = time.monotonic()
+            completions = self.run_completer(
+                parser, "prog ", completer=finder, deadline_ms=300, completer_threads=completer_threads
+            )
+            self.assertEqual(completions, expected)
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(finder.expired_completers, [slow_generator, blocking_completer, slow_async_generator])
+
+        os.environ["_ARC_DEADLINE_MS"] = "250"
+        try:
+            self.assertEqual(CompletionFinder().deadline_ms, 250)
+            self.assertEqual(CompletionFinder(deadline_ms=50).deadline_ms, 50)
+        finally:
+            del os.environ["_ARC_DEADLINE_MS"]
+        self.assertIsNone(CompletionFinder().deadline_ms)
+
     def test_skipped_completer(self):
         parser = ArgumentParser(add_help=False)
         parser.add_argument("--foo", choices=["--bar"])
@@ -894,6 +1332,12 @@ class TestArgcomplete(unittest.TestCase):
         self.assertEqual(set(self.run_completer(make_parser(), 'prog -3 "', shell="tcsh")), {"\"'"})
         self.assertEqual(set(self.run_completer(make_parser(), "prog -3 '", shell="tcsh")), {"\"'"})
 
+        self.assertEqual(set(self.run_completer(make_parser(), "prog -1 ", shell="powershell")), {"bar`<`$`>baz "})
+        self.assertEqual(set(self.run_completer(make_parser(), "prog -2 ", shell="powershell")), {r"`\`*`  "})
+        self.assertEqual(set(self.run_completer(make_parser(), 'prog -3 "', shell="powershell")), {"`\"'"})
+        self.assertEqual(set(self.run_completer(make_parser(), "prog -3 '", shell="powershell")), {"\"'\\''"})
+        self.assertEqual(set(self.run_completer(make_parser(), "prog -3 '", shell="zsh")), {"\"'\\'':"})
+
     def test_shellcode_utility(self):
         with NamedTemporaryFile() as fh:
             sc = shellcode(["prog"], use_defaults=True, shell="bash", complete_arguments=None)
@@ -921,6 +1365,146 @@ class TestArgcomplete(unittest.TestCase):
         sc = shellcode(["prog"], shell="fish")
         sc = shellcode(["prog"], shell="fish", argcomplete_script="~/.bash_completion.d/prog.py")
 
+    def run_static_bash_completer(self, parser, *comp_words):
+        sc = shellcode(["prog"], shell="bash", static=True, spec=CompletionFinder().export_spec(parser))
+        script = (
+            sc
+            + '_python_argcomplete() { COMPREPLY=(DYNAMIC); }\n'
+            + 'COMP_WORDS=("$@"); COMP_CWORD=$(( $# - 1 )); _python_argcomplete_static_prog prog\n'
+            + 'printf "%s\\n" "${COMPREPLY[@]}"\n'
+        )
+        output = subprocess.check_output(["bash", "-c", script, "bash", "prog", *comp_words], text=True)
+        return output.splitlines()
+
+    def test_static_bash_shellcode(self):
+        p = ArgumentParser()
+        p.add_argument("--ship", choices=["submarine", "speedboat", "with space"])
+        p.add_argument("--two", nargs=2, choices=["a", "b"])
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--x", action="store_true")
+        group.add_argument("--y", action="store_true")
+        p.add_argument("--env").completer = argcomplete.completers.EnvironCompleter
+        p.add_argument("--hidden", help=SUPPRESS)
+        sub = p.add_subparsers()
+        sub.add_parser("list", aliases=["ls"]).add_argument("what", choices=["cats", "dogs"])
+        sub.add_parser("show")
+
+        options = ["-h", "--help", "--ship", "--two", "--x", "--y", "--env"]
+        expected_outputs = (
+            ([""], options + ["list", "ls", "show"]),
+            (["--s"], ["--ship "]),
+            (["--ship", "s"], ["submarine", "speedboat"]),
+            (["--ship", "w"], ["with\\ space "]),
+            (["--ship", "=", "su"], ["submarine "]),
+            (["--two", "a", ""], ["a", "b"]),
+            (["--x", "--"], ["--help", "--ship", "--two", "--x", "--env"]),
+            (["l"], ["list", "ls"]),
+            (["ls", ""], ["-h", "--help", "cats", "dogs"]),
+            (["show", "-"], ["-h", "--help"]),
+            # Custom completers, and command lines the tables can't follow, run the program
+            (["--env", ""], ["DYNAMIC"]),
+            (["--unknown", ""], ["DYNAMIC"]),
+        )
+        for comp_words, output in expected_outputs:
+            self.assertEqual(self.run_static_bash_completer(p, *comp_words), output, comp_words)
+
+        with NamedTemporaryFile() as fh:
+            fh.write(shellcode(["prog"], static=True, spec=CompletionFinder().export_spec(p)).encode())
+            fh.flush()
+            subprocess.check_call(["bash", "-n", fh.name])
+        self.assertRaises(ValueError, shellcode, ["prog"], static=True)
+
+    def test_static_zsh_shellcode(self):
+        p = ArgumentParser()
+        p.add_argument("-s", "--ship", choices=["submarine", "with space"], help="ship [kind]")
+        p.add_argument("-v", action="count")
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--x", action="store_true")
+        group.add_argument("--y", action="store_true")
+        p.add_argument("--env").completer = argcomplete.completers.EnvironCompleter
+        p.add_argument("--hidden", help=SUPPRESS)
+        sub = p.add_subparsers()
+        sub.add_parser("list", aliases=["ls"], help="list: things").add_argument("what", nargs="+")
+        sub.add_parser("show")
+
+        sc = shellcode(["prog"], shell="zsh", static=True, spec=CompletionFinder().export_spec(p))
+        self.assertTrue(sc.startswith("#compdef prog\n"))
+        for spec in (
+            "'(- : *)--help[show this help message and exit]'",
+            "'(-s --ship)-s+[ship \\[kind\\]]:SHIP:(submarine with\\ space)'",
+            "'(-s --ship)--ship=[ship \\[kind\\]]:SHIP:(submarine with\\ space)'",
+            "'*-v'",
+            "'(--x --y)--x'",
+            "'(--env)--env=:ENV:{_python_argcomplete_static_prog_dynamic}'",
+            "':command:((list\\:list\\:\\ things ls\\:list\\:\\ things show\\:))'",
+            "'*::arg:->subcommand'",
+            "(list|ls) _python_argcomplete_static_prog_1 && ret=0 ;;",
+            " :what:_files ",
+            "'*:what:_files'",
+        ):
+            self.assertIn(spec, sc)
+        self.assertNotIn("--hidden", sc)
+        if shutil.which("zsh"):
+            with NamedTemporaryFile() as fh:
+                fh.write(sc.encode())
+                fh.flush()
+                subprocess.check_call(["zsh", "-n", fh.name])
+
+    def test_static_fish_shellcode(self):
+        p = ArgumentParser()
+        p.add_argument("-s", "--ship", choices=["submarine", "with space"], help="ship 'kind'")
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--x", action="store_true")
+        group.add_argument("--y", action="store_true")
+        p.add_argument("--env").completer = argcomplete.completers.EnvironCompleter
+        p.add_argument("--hidden", help=SUPPRESS)
+        sub = p.add_subparsers()
+        sub.add_parser("list", aliases=["ls"], help="list things").add_argument("what", nargs="+")
+        sub.add_parser("show")
+
+        sc = shellcode(["prog"], shell="fish", static=True, spec=CompletionFinder().export_spec(p))
+        self.assertIn("case '0 list' '0 ls'\n                set parser 1\n", sc)
+        self.assertNotIn("--hidden", sc)
+        self.assertNotIn("complete --command prog -f -a '(__fish_prog_complete)'", sc)
+        condition = "complete --command prog -n '__fish_prog_static_using_parser %d'"
+        for line in (
+            "complete --command prog -f",
+            condition % 0 + " -s s -l ship -r -a 'submarine with\\\\ space' -d 'ship \\'kind\\''",
+            "complete --command prog -n '__fish_prog_static_using_parser 0; and not __fish_seen_argument -l y' -l x",
+            condition % 0 + " -l env -r -a '(__fish_prog_complete)'",
+            condition % 0 + " -a ls -d 'list things'",
+            condition % 1 + " -F",
+            condition % 2 + " -s h -l help -d 'show this help message and exit'",
+        ):
+            self.assertIn(line + "\n", sc)
+        if shutil.which("fish"):
+            subprocess.check_call(["fish", "--no-execute", "-c", sc])
+
+    @unittest.skipUnless(shutil.which("fish"), "fish is not installed")
+    def test_static_fish_completion(self):
+        p = ArgumentParser()
+        p.add_argument("-s", "--ship", choices=["submarine", "with space"])
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--x", action="store_true")
+        group.add_argument("--y", action="store_true")
+        sub = p.add_subparsers()
+        sub.add_parser("list", aliases=["ls"], help="list things").add_argument("--all", action="store_true")
+        sub.add_parser("show").add_argument("--id", choices=["1", "2"])
+        sc = shellcode(["prog"], shell="fish", static=True, spec=CompletionFinder().export_spec(p))
+
+        def complete(command_line):
+            script = sc + "\ncomplete -C $argv[1]\n"
+            output = subprocess.check_output(["fish", "--no-config", "-c", script, command_line], text=True)
+            return {line.split("\t")[0] for line in output.splitlines()}
+
+        self.assertEqual(complete("prog l"), {"list", "ls"})
+        self.assertEqual(complete("prog --ship "), {"submarine", "with space"})
+        # Options of the parser of the last subcommand on the command line are completed
+        self.assertEqual(complete("prog --x --"), {"--help", "--ship", "--x"})
+        self.assertEqual(complete("prog --y ls --"), {"--help", "--all"})
+        self.assertEqual(complete("prog -s submarine show --"), {"--help", "--id"})
+        self.assertEqual(complete("prog show --id "), {"1", "2"})
+
     def test_option_help(self):
         os.environ["_ARGCOMPLETE_DFS"] = "\t"
         os.environ["_ARGCOMPLETE_SUPPRESS_SPACE"] = "1"
@@ -945,6 +1529,422 @@ class TestArgcomplete(unittest.TestCase):
         os.environ["_ARGCOMPLETE_DFS"] = "invalid"
         self.assertRaises(Exception, self.run_completer, p, "prog --b", shell="fish")
 
+    def test_export_spec(self):
+        p = ArgumentParser(prog="prog")
+        p.add_argument("--ship", choices=["submarine", "speedboat"], help="ship %(default)s", default="submarine")
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--a", action="store_true")
+        group.add_argument("--b", help=SUPPRESS)
+        p.add_argument("--env").completer = argcomplete.completers.EnvironCompleter
+        sub = p.add_subparsers()
+        ls = sub.add_parser("list", aliases=["ls"], help="list things")
+        ls.add_argument("items", nargs="+").completer = DirectoriesCompleter()
+
+        spec = CompletionFinder().export_spec(p)
+        self.assertEqual(spec["version"], argcomplete.spec.SPEC_VERSION)
+        root = spec["parser"]
+        self.assertEqual(root["prog"], "prog")
+        actions = {a["dest"]: a for a in root["actions"]}
+        self.assertEqual(actions["ship"]["choices"], ["submarine", "speedboat"])
+        self.assertEqual(actions["ship"]["help"], "ship submarine")
+        self.assertEqual(actions["a"]["action"], "store_true")
+        self.assertTrue(actions["b"]["suppressed"])
+        env_completer = {"kind": "custom", "ref": "argcomplete.completers:EnvironCompleter"}
+        self.assertEqual(actions["env"]["completer"], env_completer)
+        self.assertEqual(root["mutually_exclusive_groups"], [{"required": False, "actions": [2, 3]}])
+        (subcommand,) = root["actions"][-1]["subcommands"]
+        self.assertEqual(subcommand["name"], "list")
+        self.assertEqual(subcommand["aliases"], ["ls"])
+        self.assertEqual(subcommand["help"], "list things")
+        self.assertEqual(subcommand["parser"]["actions"][-1]["nargs"], "+")
+        self.assertEqual(subcommand["parser"]["actions"][-1]["completer"]["kind"], "directories")
+        # The spec must survive a JSON round trip unchanged
+        self.assertEqual(json.loads(json.dumps(spec)), spec)
+
+        # Lambdas have no importable reference, even at module level
+        module_lambda = eval("lambda **kwargs: []", {"__name__": "argcomplete.completers"})
+        self.assertIsNone(argcomplete.spec.completer_reference(module_lambda))
+        self.assertEqual(
+            argcomplete.spec.completer_reference(argcomplete.completers.EnvironCompleter),
+            "argcomplete.completers:EnvironCompleter",
+        )
+
+    def test_export_spec_script(self):
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-m",
+                "argcomplete.scripts.register_python_argcomplete",
+                "--export-spec",
+                "test.test:make_export_spec_parser",
+            ],
+            cwd=BASE_DIR,
+        )
+        spec = json.loads(output)
+        self.assertEqual(spec["parser"]["prog"], "export-spec-prog")
+        self.assertEqual(spec["parser"]["actions"][-1]["option_strings"], ["--foo"])
+
+    def test_spec_cache(self):
+        calls = []
+
+        class CountAction(argparse._StoreAction):
+            pass
+
+        def make_parser():
+            calls.append(1)
+            parser = ArgumentParser()
+            parser.register("action", "count_store", CountAction)
+            parser.add_argument("--ship", choices=["submarine", "speedboat"])
+            parser.add_argument("--env").completer = lambda **kwargs: ["live"]
+            parser.add_argument("--num", action="count_store", choices=["1", "2"])
+            sub = parser.add_subparsers()
+            sub.add_parser("list", aliases=["ls"], help="list 100%% of things").add_argument(
+                "--all", action="store_true", help="use 100%% of %(dest)s"
+            )
+            return parser
+
+        with TempDir(prefix="test_dir_spec_cache") as d, NamedTemporaryFile(dir=d, suffix=".py") as script:
+            os.environ["XDG_CACHE_HOME"] = d
+            argv, sys.argv = sys.argv, [script.name]
+            try:
+                completions = self.run_completer(make_parser, "prog --shi", spec_cache=True)
+                self.assertEqual(completions, ["--ship "])
+                self.assertEqual(len(calls), 1)
+
+                # Cache hits don't build the live parser
+                completions = self.run_completer(make_parser, "prog --ship s", spec_cache=True)
+                self.assertEqual(set(completions), {"submarine", "speedboat"})
+                self.assertEqual(self.run_completer(make_parser, "prog ls --a", spec_cache=True), ["--all "])
+                # Help strings are shown as the live parser expands them
+                self.assertEqual(
+                    self.run_completer(make_parser, "prog ls --", spec_cache=True, shell="zsh"),
+                    ["--help:show this help message and exit", "--all:use 100% of all"],
+                )
+                self.assertEqual(
+                    self.run_completer(make_parser, "prog l", spec_cache=True, shell="zsh"),
+                    ["list:list 100% of things", "ls:list 100% of things"],
+                )
+                # Actions registered by the program are stood in for
+                self.assertEqual(self.run_completer(make_parser, "prog --num ", spec_cache=True), ["1", "2"])
+                self.assertEqual(len(calls), 1)
+
+                # Custom completers fall back to the live parser
+                self.assertEqual(self.run_completer(make_parser, "prog --env ", spec_cache=True), ["live "])
+                self.assertEqual(len(calls), 2)
+
+                # Changing the program invalidates the cache
+                os.utime(script.name, ns=(0, 0))
+                self.assertEqual(self.run_completer(make_parser, "prog --shi", spec_cache=True), ["--ship "])
+                self.assertEqual(len(calls), 3)
+                self.assertEqual(self.run_completer(make_parser, "prog --shi", spec_cache=True), ["--ship "])
+                self.assertEqual(len(calls), 3)
+
+                # Specs that can't be rebuilt fall back to the live parser
+                fingerprint = argcomplete.cache.executable_fingerprint()
+                argcomplete.cache.save_spec(fingerprint, {"version": argcomplete.spec.SPEC_VERSION, "parser": {}})
+                self.assertEqual(self.run_completer(make_parser, "prog --shi", spec_cache=True), ["--ship "])
+                self.assertEqual(len(calls), 4)
+            finally:
+                sys.argv = argv
+
+    def test_spec_cache_unformattable_help(self):
+        def make_parser():
+            parser = ArgumentParser()
+            parser.add_argument("--ship", choices=["submarine", "speedboat"], help="50% done")
+            return parser
+
+        with TempDir(prefix="test_dir_spec_cache") as d, NamedTemporaryFile(dir=d, suffix=".py") as script:
+            os.environ["XDG_CACHE_HOME"] = d
+            argv, sys.argv = sys.argv, [script.name]
+            try:
+                # Parsers whose spec can't be exported are completed without the cache
+                for _ in range(2):
+                    self.assertEqual(self.run_completer(make_parser, "prog --shi", spec_cache=True), ["--ship "])
+                fingerprint = argcomplete.cache.executable_fingerprint()
+                self.assertIsNone(argcomplete.cache.load_spec(fingerprint))
+            finally:
+                sys.argv = argv
+
+    def test_cached_completer(self):
+        calls = []
+
+        def slow_completer(prefix, parsed_args, **kwargs):
+            calls.append(prefix)
+            time.sleep(0.1)
+            return {f"{prefix}{parsed_args.region}1": "first", f"{prefix}{parsed_args.region}2": "second"}
+
+        def make_parser(**kwargs):
+            parser = ArgumentParser()
+            parser.add_argument("--region")
+            parser.add_argument("--debug", action="store_true")
+            parser.add_argument("--host").completer = CachedCompleter(slow_completer, key=["region"], **kwargs)
+            return parser
+
+        with TempDir(prefix="test_dir_cached_completer") as d:
+            os.environ["XDG_CACHE_HOME"] = d
+            expected = ["eu1:first", "eu2:second"]
+            self.assertEqual(self.run_completer(make_parser(), "prog --region eu --host ", shell="zsh"), expected)
+            # Descriptions are kept, and unrelated arguments don't affect the key
+            command = "prog --debug --region eu --host "
+            self.assertEqual(self.run_completer(make_parser(), command, shell="zsh"), expected)
+            self.assertEqual(calls, [""])
+            self.assertEqual(self.run_completer(make_parser(), "prog --region us --host "), ["us1", "us2"])
+            self.assertEqual(self.run_completer(make_parser(), "prog --region us --host u"), ["uus1", "uus2"])
+            self.assertEqual(calls, ["", "", "u"])
+
+            # Expired entries are computed again
+            self.assertEqual(self.run_completer(make_parser(ttl=-1), "prog --region eu --host "), ["eu1", "eu2"])
+            self.assertEqual(calls, ["", "", "u", ""])
+
+            # The least recently used entries are evicted
+            (directory,) = os.listdir(os.path.join(d, "argcomplete", "completers"))
+            directory = os.path.join(d, "argcomplete", "completers", directory)
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith(".json")]), 3)
+            self.run_completer(make_parser(max_entries=2), "prog --region ap --host ")
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith(".json")]), 2)
+            self.run_completer(make_parser(), "prog --region eu --host ")
+            self.assertEqual(calls, ["", "", "u", "", ""])
+            self.run_completer(make_parser(), "prog --region us --host ")
+            self.assertEqual(calls, ["", "", "u", "", "", ""])
+
+            # Concurrent completions compute each entry once
+            del calls[:]
+            completer = CachedCompleter(slow_completer, key=["region"])
+            kwargs = {
+                "prefix": "x",
+                "action": make_parser()._actions[-1],
+                "parsed_args": argparse.Namespace(region="eu"),
+            }
+            threads = [threading.Thread(target=completer, kwargs={**kwargs, "parser": None}) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(calls, ["x"])
+
+    def test_cached_completer_refresh(self):
+        versions = []
+
+        def versioned_completer(**kwargs):
+            versions.append(1)
+            return [f"v{len(versions)}"]
+
+        parser = ArgumentParser()
+        parser.add_argument("--version").completer = CachedCompleter(versioned_completer, ttl=-1, refresh=True)
+
+        def wait_for_refresh():
+            for _ in range(100):
+                if not glob.glob(os.path.join(d, "argcomplete", "completers", "*", "*.refresh")):
+                    return
+                time.sleep(0.05)
+            self.fail("Completions were not refreshed")
+
+        with TempDir(prefix="test_dir_cached_completer_refresh") as d:
+            os.environ["XDG_CACHE_HOME"] = d
+            self.assertEqual(self.run_completer(parser, "prog --version "), ["v1 "])
+            # Expired completions are used while a child process computes new ones
+            self.assertEqual(self.run_completer(parser, "prog --version "), ["v1 "])
+            wait_for_refresh()
+            self.assertEqual(self.run_completer(parser, "prog --version "), ["v2 "])
+            wait_for_refresh()
+            self.assertEqual(versions, [1])
+
+            # Only one process refreshes each entry
+            (path,) = glob.glob(os.path.join(d, "argcomplete", "completers", "*", "*.json"))
+            self.assertTrue(argcomplete.cache.claim_refresh(path))
+            self.assertFalse(argcomplete.cache.claim_refresh(path))
+            self.assertEqual(self.run_completer(parser, "prog --version "), ["v2 "])
+            self.assertEqual(versions, [1])
+            argcomplete.cache.release_refresh(path)
+            self.assertTrue(argcomplete.cache.claim_refresh(path))
+
+    def test_completion_server(self):
+        calls = []
+
+        def count_completer(**kwargs):
+            calls.append(1)
+            return [str(len(calls))]
+
+        p = ArgumentParser()
+        p.add_argument("--ship", choices=["submarine", "speedboat"])
+        p.add_argument("--cwd").completer = lambda **kwargs: [os.path.basename(os.getcwd())]
+        p.add_argument("--count").completer = count_completer
+
+        for server_class in argcomplete.daemon.CompletionServer, argcomplete.daemon.ForkServer:
+            with self.subTest(server_class=server_class), TempDir(prefix="test_dir_daemon") as d:
+                os.environ["XDG_RUNTIME_DIR"] = d
+                server = server_class(p, idle_timeout=1)
+                self.assertEqual(server.path, os.path.join(d, "argcomplete", os.path.basename(sys.argv[0]) + ".sock"))
+                self.assertTrue(server.bind())
+                self.assertFalse(server_class(p).bind())
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                try:
+                    client = os.path.join(d, "argcomplete", "client")
+
+                    def complete(command, executable=sys.argv[0], client=client, fd=8):
+                        r, w = os.pipe()
+                        os.dup2(w, fd)
+                        os.close(w)
+                        env = dict(os.environ, COMP_LINE=command, COMP_POINT=str(len(command)), _ARGCOMPLETE="1")
+                        env.pop("_ARC_DEBUG")
+                        try:
+                            code = subprocess.call([client, executable], env=env, pass_fds=[fd], cwd=d)
+                        finally:
+                            os.close(fd)
+                        with os.fdopen(r) as fh:
+                            return code, fh.read().split(IFS)
+
+                    self.assertEqual(complete("prog --ship s"), (0, ["submarine", "speedboat"]))
+                    # The request's working directory is used
+                    self.assertEqual(complete("prog --cwd "), (0, [os.path.basename(d) + " "]))
+                    # Completer state is kept by the server process, and discarded by the children of fork servers
+                    self.assertEqual(complete("prog --count "), (0, ["1 "]))
+                    expected = "1 " if server_class is argcomplete.daemon.ForkServer else "2 "
+                    self.assertEqual(complete("prog --count "), (0, [expected]))
+                    del calls[:]
+                    # Requests for other programs are refused
+                    self.assertEqual(complete("prog --ship s", executable=os.path.join(d, "other")), (1, [""]))
+                    if server_class is argcomplete.daemon.ForkServer:
+                        # Fork servers don't take the debug stream for the output stream when fd 8 is closed
+                        self.assertEqual(complete("prog --ship s", fd=9), (1, [""]))
+                finally:
+                    thread.join()
+                self.assertFalse(os.path.exists(server.path))
+
+    def test_completion_server_options(self):
+        converted = []
+
+        def convert(value):
+            converted.append(value)
+            return value
+
+        p = ArgumentParser()
+        p.add_argument("--size", type=convert)
+        p.add_argument("--ship", choices=["submarine", "speedboat"])
+
+        servers = []
+        spawn_server, argcomplete.daemon.spawn_server = argcomplete.daemon.spawn_server, servers.append
+        try:
+            self.run_completer(p, "prog --size 1 --ship s", daemon=True, convert_values=False, max_completions=1)
+        finally:
+            argcomplete.daemon.spawn_server = spawn_server
+        (server,) = servers
+        self.assertEqual(server.finder_kwargs["convert_values"], False)
+        self.assertEqual(server.finder_kwargs["max_completions"], 1)
+        self.assertNotIn("daemon", server.finder_kwargs)
+
+        # Requests to the server are completed with the options of the first completion
+        command = "prog --size 1 --ship s"
+        environ = dict(os.environ, COMP_LINE=command, COMP_POINT=str(len(command)), _ARGCOMPLETE="1")
+        reply = server.complete({"cwd": os.getcwd(), "environ": environ}, [])
+        self.assertEqual(reply, {"status": "ok", "output": "submarine "})
+        self.assertEqual(converted, [])
+
+    def test_completion_server_deadline(self):
+        release = threading.Event()
+
+        def stuck_completer(**kwargs):
+            release.wait(5)
+            return ["late"]
+
+        p = ArgumentParser()
+        p.add_argument("--ship", choices=["submarine", "speedboat"])
+        p.add_argument("--stuck").completer = stuck_completer
+        server = argcomplete.daemon.CompletionServer(p, finder_kwargs={"deadline_ms": 50})
+
+        def handle(command):
+            environ = dict(os.environ, COMP_LINE=command, COMP_POINT=str(len(command)), _ARGCOMPLETE="1")
+            request = {"executable": server.executable, "cwd": os.getcwd(), "environ": environ}
+            server_end, client_end = socket.socketpair()
+            with server_end, client_end:
+                client_end.sendall(json.dumps(request).encode() + b"\n")
+                return server.handle(server_end)
+
+        try:
+            self.assertTrue(handle("prog --ship s"))
+            # Completers abandoned at the deadline keep running in the server, which exits instead of serving more
+            self.assertFalse(handle("prog --stuck "))
+        finally:
+            release.set()
+
+    def test_completion_server_parser_factory(self):
+        built = []
+
+        def make_parser():
+            built.append(1)
+            p = ArgumentParser()
+            p.add_argument("--ship", choices=["submarine", "speedboat"])
+            return p
+
+        servers = []
+        spawn_server, argcomplete.daemon.spawn_server = argcomplete.daemon.spawn_server, servers.append
+        try:
+            self.run_completer(make_parser, "prog --ship s", daemon=True)
+        finally:
+            argcomplete.daemon.spawn_server = spawn_server
+        (server,) = servers
+
+        # The server reuses the parser built for the first completion
+        command = "prog --ship s"
+        environ = dict(os.environ, COMP_LINE=command, COMP_POINT=str(len(command)), _ARGCOMPLETE="1")
+        for _ in range(2):
+            reply = server.complete({"cwd": os.getcwd(), "environ": environ}, [])
+            self.assertEqual(reply, {"status": "ok", "output": "submarine\vspeedboat"})
+        self.assertEqual(built, [1])
+
+    def test_lazy_subparsers(self):
+        built = []
+
+        def make_parser():
+            def add_arguments(name):
+                def factory(parser):
+                    built.append(name)
+                    parser.add_argument("--" + name, choices=["x", "y"])
+
+                return factory
+
+            parser = ArgumentParser()
+            sub = parser.add_subparsers(dest="command", action=argcomplete.LazySubParsersAction)
+            sub.add_lazy_parser("alpha", add_arguments("alpha"), aliases=["a"], help="alpha help")
+            sub.add_lazy_parser("beta", add_arguments("beta"), help="beta help")
+            return parser
+
+        self.assertEqual(set(self.run_completer(make_parser(), "prog ")), {"-h", "--help", "alpha", "a", "beta"})
+        self.assertEqual(built, [])
+        os.environ["_ARGCOMPLETE_DFS"] = "\t"
+        self.assertEqual(
+            set(self.run_completer(make_parser(), "prog ", shell="fish")),
+            {
+                "-h\tshow this help message and exit",
+                "--help\tshow this help message and exit",
+                "alpha\talpha help",
+                "a\talpha help",
+                "beta\tbeta help",
+            },
+        )
+        self.assertEqual(built, [])
+        del os.environ["_ARGCOMPLETE_DFS"]
+        self.assertEqual(set(self.run_completer(make_parser(), "prog a --alpha ")), {"x", "y"})
+        self.assertEqual(built, ["alpha"])
+
+        del built[:]
+        args = make_parser().parse_args(["beta", "--beta", "y"])
+        self.assertEqual((args.command, args.beta), ("beta", "y"))
+        self.assertEqual(built, ["beta"])
+
+        # Exporting a spec needs every subcommand
+        del built[:]
+        spec = CompletionFinder().export_spec(make_parser())
+        self.assertEqual(sorted(built), ["alpha", "beta"])
+        self.assertEqual([sub["name"] for sub in spec["parser"]["actions"][1]["subcommands"]], ["alpha", "beta"])
+
+
+def make_export_spec_parser():
+    parser = ArgumentParser(prog="export-spec-prog")
+    parser.add_argument("--foo")
+    return parser
+
 
 class TestArgcompleteREPL(unittest.TestCase):
     def setUp(self):
@@ -1368,6 +2368,38 @@ class TestBash(TestBashZshBase, unittest.TestCase):
         self.test_simple_completion()
 
 
+class StaticShellMixin:
+    """
+    Runs the tests of a shell against static completions generated from the spec of ``prog``.
+    """
+
+    shell = "bash"
+
+    def setUp(self):
+        argv, sys.argv = sys.argv, ["prog", "basic", "foo"]
+        try:
+            with argcomplete.io.mute_stdout():
+                parser = runpy.run_path(os.path.join(TEST_DIR, "prog"))["parser"]
+        finally:
+            sys.argv = argv
+        self.spec_file = NamedTemporaryFile(mode="w", suffix=".json")
+        json.dump(CompletionFinder().export_spec(parser), self.spec_file)
+        self.spec_file.flush()
+        register = f"{sys.executable} -m argcomplete.scripts.register_python_argcomplete"
+        self.install_cmd = f'eval "$({register} --shell {self.shell} --static {self.spec_file.name} dummy prog)"'
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.spec_file.close()
+
+
+class TestBashStatic(StaticShellMixin, TestBash):
+    @unittest.skip("static completion does not run the program for built-in completers")
+    def test_temp_file(self):
+        pass
+
+
 class TestZsh(TestBashZshBase, unittest.TestCase):
     init_cmd = "autoload compinit; compinit -u"
 
@@ -1382,6 +2414,10 @@ class TestZsh(TestBashZshBase, unittest.TestCase):
         return zsh_repl()
 
 
+class TestZshStatic(StaticShellMixin, TestZsh):
+    shell = "zsh"
+
+
 class TestBashZshGlobalBase(TestBashZshBase):
     install_cmd = 'eval "$(activate-global-python-argcomplete --dest=-)"'
 